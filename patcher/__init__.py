@@ -11,48 +11,232 @@
     Newer: https://github.com/Kovalit31/python-patch
 """
 
-from io import StringIO
+import http.client
+from concurrent.futures import ThreadPoolExecutor
 
-import urllib
 from . import utils
+from .utils.httputil import DEFAULT_TIMEOUT, DEFAULT_BUFSIZE
 
 #-----------------------------------------------
 # Main API functions
 
 logger = utils.logger.Log(logging_name=__name__)
 
-def fromfile(filename, debugmode=False):
+def fromfile(filename, debugmode=False, mmap=False, lazy=False, workers=None,
+             cache_dir=None, spillsize=None, include=None, exclude=None,
+             limits=None):
   """ Parse patch file. If successful, returns
       PatchSet() object. Otherwise returns False.
+
+      With `mmap` the file is mapped into memory and hunk
+      lines are kept as views into this single buffer.
+      With `lazy` only hunk headers and line stats are
+      parsed, hunk lines are read from file on access.
+      With `workers` > 1 file is parsed in parallel by
+      that many processes (not used with mmap, lazy and
+      spillsize).
+      With `cache_dir` parsed result is stored in that
+      directory and reused when the same patch is parsed
+      again (not used with lazy and spillsize).
+      With `spillsize` lines of hunks bigger than that many
+      bytes are kept in temporary files instead of memory.
+      gzip, bzip2 and xz compressed files are decompressed
+      while parsing (mmap, lazy and workers are ignored).
+      With `include` and `exclude` lists of shell patterns
+      only diffs of matching files are parsed, hunks of other
+      files are skipped (cache and workers are not used).
+      With `limits` (utils.dataobjects.Limits) parsing stops
+      with an error when input exceeds one of them (cache and
+      workers are not used).
   """
-  patchset = utils.patch.PatchSet(lg=logger, debugmode=debugmode)
+  restricted = include is not None or exclude or limits
+  cache = key = None
+  if cache_dir and not (lazy or spillsize or restricted):
+    cache = utils.cache.ParseCache(cache_dir, lg=logger)
+    key = cache.key(filename)
+    cached = cache.load(key, lg=logger, debugmode=debugmode)
+    if cached:
+      res, patchset = cached
+      return patchset if res == True else False
+
+  patchset = utils.patch.PatchSet(lg=logger, debugmode=debugmode, lazy=lazy,
+                                  spillsize=spillsize, include=include,
+                                  exclude=exclude, limits=limits)
   logger.debug("reading %s" % filename)
-  fp = open(filename, "rb")
-  res = patchset.parse(fp)
-  fp.close()
+  res = patchset.parse_file(filename, mmap=mmap, workers=workers)
+  if cache:
+    cache.store(key, res, patchset)
   if res == True:
     return patchset
   return False
 
 
-def fromstring(s, debugmode=False):
-  """ Parse text string and return PatchSet()
-      object (or False if parsing fails)
+def fromfiles(filenames, debugmode=False, workers=None, statsonly=False):
+  """ Parse many patch files with `workers` processes.
+      Returns BatchResult - list of ParseResult objects in
+      the same order as `filenames`, each with `ok` status,
+      error counters, stats and parsed PatchSet (None with
+      `statsonly`). BatchResult.failed lists failed files,
+      BatchResult.diffstat() is the diffstat of all files,
+      computed from stats gathered in workers.
+  """
+  return utils.batch.parse_files(filenames, workers=workers,
+                                 debugmode=debugmode, statsonly=statsonly,
+                                 lg=logger)
+
+
+def fromdir(directory, pattern="*.patch", debugmode=False, workers=None,
+            statsonly=False, recursive=True):
+  """ Parse files in directory that match shell `pattern`
+      in sorted order, see fromfiles()
+  """
+  filenames = utils.batch.find_files(directory, pattern, recursive)
+  logger.debug("%d files match %s in %s" % (len(filenames), pattern, directory))
+  return fromfiles(filenames, debugmode=debugmode, workers=workers,
+                   statsonly=statsonly)
+
+
+def fromcontainer(filename, debugmode=False, mmap=False):
+  """ Load PatchSet() saved with PatchSet.save(). Returns
+      False if file is not a patch container.
+  """
+  patchset = utils.patch.PatchSet(lg=logger, debugmode=debugmode)
+  logger.debug("loading %s" % filename)
+  if utils.container.load(filename, patchset, mmap=mmap):
+    return patchset
+  return False
+
+
+def fromstring(s, debugmode=False, include=None, exclude=None, limits=None):
+  """ Parse string and return PatchSet() object (or False
+      if parsing fails). bytes, bytearray and memoryview are
+      parsed in place without copying, str is encoded to
+      utf-8 first. `include`, `exclude` and `limits` are
+      the same as in fromfile().
   """
-  ps = utils.patch.PatchSet(StringIO(s), lg=logger, debugmode=debugmode)
+  if isinstance(s, str):
+    s = s.encode("utf-8")
+  ps = utils.patch.PatchSet(utils.buffers.BufferReader(s), lg=logger,
+                            debugmode=debugmode, include=include,
+                            exclude=exclude, limits=limits)
   if ps.errors == 0:
     return ps
   return False
 
 
-def fromurl(url, debugmode=False):
+def fromurl(url, debugmode=False, timeout=DEFAULT_TIMEOUT,
+            bufsize=DEFAULT_BUFSIZE, include=None, exclude=None):
   """ Parse patch from an URL, return False
       if an error occured. Note that this also
       can throw urlopen() exceptions.
+
+      Response is parsed while it is downloaded, gzip and
+      deflate Content-Encoding is decoded on the fly. Data
+      is read from the connection in `bufsize` blocks.
+      `include` and `exclude` select files as in fromfile().
   """
-  ps = utils.patch.PatchSet(urllib.request.urlopen(url), debugmode=debugmode, lg=logger)
+  ps = utils.patch.PatchSet(lg=logger, debugmode=debugmode, include=include,
+                            exclude=exclude)
+  stream = utils.httputil.urlopen(url, timeout, bufsize)
+  try:
+    ps.parse(stream)
+  finally:
+    stream.close()
   if ps.errors == 0:
     return ps
   return False
 
+
+def fromurls(urls, debugmode=False, workers=4, timeout=DEFAULT_TIMEOUT,
+             bufsize=DEFAULT_BUFSIZE):
+  """ Parse patches from several URLs with `workers` threads.
+      Connections to the same host are kept open and reused.
+      Returns list with PatchSet() or False for every URL,
+      in the same order. Fetch errors are logged as warnings
+      and give False.
+  """
+  pool = utils.httputil.ConnectionPool(timeout, bufsize)
+
+  def fetch(url):
+    ps = utils.patch.PatchSet(lg=logger, debugmode=debugmode)
+    try:
+      stream = pool.open(url)
+      try:
+        ps.parse(stream)
+      finally:
+        stream.close()
+    except (IOError, OSError, http.client.HTTPException) as e:
+      logger.warning("error fetching %s: %s" % (url, e))
+      return False
+    if ps.errors == 0:
+      return ps
+    return False
+
+  try:
+    with ThreadPoolExecutor(max(workers, 1)) as executor:
+      return list(executor.map(fetch, urls))
+  finally:
+    pool.close()
+
+
+def iterfile(filename, debugmode=False, include=None, exclude=None):
+  """ Parse patch file and yield Patch objects as soon
+      as they are parsed. Unlike fromfile() parsed patches
+      are not kept in memory. `include` and `exclude` select
+      files as in fromfile().
+  """
+  patchset = utils.patch.PatchSet(lg=logger, debugmode=debugmode,
+                                  include=include, exclude=exclude)
+  logger.debug("reading %s" % filename)
+  fp = open(filename, "rb")
+  try:
+    stream, compression = utils.compress.open_stream(fp)
+    for p in patchset.iterparse(stream):
+      yield p
+  finally:
+    fp.close()
+
+
+def split(filename, directory, debugmode=False, include=None, exclude=None):
+  """ Split patch file into one .patch file per changed
+      file in `directory`. File diffs are written as soon
+      as they are parsed, so memory use does not depend on
+      patch size. Returns list of written filenames.
+  """
+  return utils.split.split_patches(iterfile(filename, debugmode=debugmode,
+                                            include=include, exclude=exclude),
+                                   directory, lg=logger)
+
+
+def iterseries(filename, debugmode=False, include=None, exclude=None):
+  """ Read mbox file with a series of patches, such as
+      `git format-patch --stdout` output, and yield Commit
+      (PatchSet with subject, author, email, date and sha of
+      the commit) for every message as soon as it is parsed.
+  """
+  logger.debug("reading series %s" % filename)
+  fp = open(filename, "rb")
+  try:
+    stream, compression = utils.compress.open_stream(fp)
+    for commit in utils.series.iterseries(stream, lg=logger, debugmode=debugmode,
+                                          include=include, exclude=exclude):
+      yield commit
+  finally:
+    fp.close()
+
+
+def iterurl(url, debugmode=False, timeout=DEFAULT_TIMEOUT,
+            bufsize=DEFAULT_BUFSIZE):
+  """ Parse patch from an URL and yield Patch objects
+      as soon as they are parsed. Note that this also
+      can throw urlopen() exceptions.
+  """
+  patchset = utils.patch.PatchSet(lg=logger, debugmode=debugmode)
+  stream = utils.httputil.urlopen(url, timeout, bufsize)
+  try:
+    for p in patchset.iterparse(stream):
+      yield p
+  finally:
+    stream.close()
+
 # /API
\ No newline at end of file
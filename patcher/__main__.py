@@ -1,14 +1,27 @@
 import logging
 from optparse import OptionParser
-from os.path import exists
+from os.path import exists, isfile
 import sys
-from .utils import patch, pathutil, logger
+from .utils import compress, export, httputil, patch, pathutil, logger, split
 from . import fromfile, fromstring, fromurl
 patcher = patch
 
 __author__ = "anatoly techtonik <techtonik@gmail.com>, Kovalit31 <nonecone20@gmail.com>"
 __version__ = "1.17"
 
+def open_input(patchfile, isurl):
+  """ return (stream, file to close) for patch file, URL or
+      stdin if patchfile is None
+  """
+  if patchfile is None:
+    stream, compression = compress.open_stream(sys.stdin.buffer)
+    return stream, None
+  if isurl:
+    return httputil.urlopen(patchfile), None
+  fp = open(patchfile, "rb")
+  stream, compression = compress.open_stream(fp)
+  return stream, fp
+
 def main():
 
   opt = OptionParser(usage="1. %prog [options] unified.diff\n"
@@ -22,12 +35,28 @@ def main():
   opt.add_option("--debug", action="store_true", dest="debugmode", help="debug mode")
   opt.add_option("--diffstat", action="store_true", dest="diffstat",
                                            help="print diffstat and exit")
+  opt.add_option("--numstat", action="store_true",
+                                           help="print added and deleted lines for every file and exit")
   opt.add_option("-d", "--directory", metavar='DIR',
                                            help="specify root directory for applying patch")
   opt.add_option("-p", "--strip", type="int", metavar='N', default=0,
                                            help="strip N path components from filenames")
   opt.add_option("--revert", action="store_true",
                                            help="apply patch in reverse order (unpatch)")
+  opt.add_option("-j", "--jobs", type="int", metavar='N', default=1,
+                                           help="parse patch file with N processes")
+  opt.add_option("--cache", metavar='DIR',
+                                           help="cache parsed patch files in DIR")
+  opt.add_option("--format", choices=["ndjson"],
+                                           help="print parsed patches in structured format and exit (ndjson)")
+  opt.add_option("--lines", action="store_true",
+                                           help="include hunk lines in --format output")
+  opt.add_option("--split", metavar='DIR',
+                                           help="write diff of every file into its own .patch file in DIR and exit")
+  opt.add_option("-I", "--include", action="append", metavar='PATTERN',
+                                           help="use only diffs of files matching shell PATTERN (can be repeated)")
+  opt.add_option("-X", "--exclude", action="append", metavar='PATTERN',
+                                           help="skip diffs of files matching shell PATTERN (can be repeated)")
   (options, args) = opt.parse_args()
 
   if not args and sys.argv[-1:] != ['--']:
@@ -49,22 +78,59 @@ def main():
   lg.set_verbosity(loglevel)
   lg.set_logformat(logformat)
   
-  if readstdin:
-    patch = patcher.PatchSet(sys.stdin, lg=lg, debugmode=debugmode)
-  else:
+  patchfile = isurl = None
+  if not readstdin:
     patchfile = args[0]
     urltest = patchfile.split(':')[0]
-    if (':' in patchfile and urltest.isalpha()
-        and len(urltest) > 1): # one char before : is a windows drive letter
-      patch = fromurl(patchfile, debugmode=debugmode)
-    else:
-      if not exists(patchfile) or not pathutil.isfile(patchfile):
-        sys.exit("patch file does not exist - %s" % patchfile)
-      patch = fromfile(patchfile, debugmode=debugmode)
+    isurl = (':' in patchfile and urltest.isalpha()
+             and len(urltest) > 1) # one char before : is a windows drive letter
+    if not isurl and (not exists(patchfile) or not isfile(patchfile)):
+      sys.exit("patch file does not exist - %s" % patchfile)
 
-  if options.diffstat:
-    print(patch.diffstat())
-    sys.exit(0)
+  if options.split or options.format or options.diffstat or options.numstat:
+    # stream parsed file diffs to output without keeping hunk lines
+    statsonly = not (options.split or options.format)
+    patch = patcher.PatchSet(lg=lg, debugmode=debugmode,
+                             include=options.include, exclude=options.exclude,
+                             statsonly=statsonly)
+    stream, fp = open_input(patchfile, isurl)
+    try:
+      if options.numstat:
+        # every file is printed as soon as it is parsed
+        for p in patch.iterparse(stream):
+          sys.stdout.write(patcher.format_numstat([(p.target,) + p.stats()]))
+        sys.exit(0)
+      if statsonly:
+        # hunk lines are not kept, but column widths depend on all
+        # files, so stats of every file are (memory grows with files)
+        stats = [(p.target,) + p.stats() for p in patch.iterparse(stream)]
+        print(patcher.format_diffstat(stats))
+        sys.exit(0)
+      if options.split:
+        written = split.split_patches(patch.iterparse(stream), options.split, lg)
+        lg.info("%d files written to %s" % (len(written), options.split))
+      else:
+        export.write_ndjson(patch.iterparse(stream), sys.stdout.buffer,
+                            lines=options.lines)
+        sys.stdout.flush()
+    finally:
+      stream.close()
+      if fp:
+        fp.close()
+    sys.exit(0 if patch.errors == 0 else -1)
+
+  if readstdin:
+    stream, compression = compress.open_stream(sys.stdin.buffer)
+    patch = patcher.PatchSet(stream, lg=lg, debugmode=debugmode,
+                             include=options.include, exclude=options.exclude)
+  else:
+    if isurl:
+      patch = fromurl(patchfile, debugmode=debugmode,
+                      include=options.include, exclude=options.exclude)
+    else:
+      patch = fromfile(patchfile, debugmode=debugmode, workers=options.jobs,
+                       cache_dir=options.cache, include=options.include,
+                       exclude=options.exclude)
 
   #pprint(patch)
   if options.revert:
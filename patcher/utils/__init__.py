@@ -1 +1 @@
-from . import dataobjects, logger, patch, pathutil, variables
\ No newline at end of file
+from . import accel, batch, buffers, cache, compress, container, dataobjects, export, httputil, index, logger, patch, pathutil, series, split, variables
\ No newline at end of file
@@ -0,0 +1,136 @@
+#------------------------------------------------
+# Optional NumPy acceleration
+
+# When NumPy is available, hunk bodies in buffers are
+# classified for many lines at once - newline positions,
+# first bytes of lines and line ends are found with array
+# operations instead of a Python loop for every line.
+# Results are the same as of pure Python code, which is
+# used when NumPy is missing and for small hunks, where
+# array setup costs more than it saves.
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+MIN_LINES = 64   # hunks with fewer lines are scanned line by line
+
+
+def _array(buf):
+  """ return uint8 array over buffer or None if buffer
+      doesn't support buffer protocol
+  """
+  try:
+    return numpy.frombuffer(buf, dtype=numpy.uint8)
+  except (TypeError, ValueError):
+    return None
+
+
+def scan_hunk(buf, pos, srcleft, tgtleft):
+  """ vectorized version of PatchSet._scan_buffer() loop. Scans
+      hunk lines in `buf` starting at `pos` while they match
+      line counts left in hunk.
+
+      return (line starts, end offset, srcleft, tgtleft, inserts,
+              deletes, delta, crlf, lf, cr, consumed) or None if
+      the hunk should be scanned line by line
+  """
+  data = _array(buf)
+  if data is None:
+    return None
+  size = len(data)
+  # each line takes one of src or tgt lines, except for
+  # "\ No newline at end of file" markers
+  maxlines = srcleft + tgtleft + 2
+  window = maxlines * 64
+  while True:
+    end = min(size, pos + window)
+    eols = numpy.flatnonzero(data[pos:end] == 10)
+    if len(eols) >= maxlines or end == size:
+      break
+    window *= 4
+  ends = eols[:maxlines] + (pos + 1)
+  noeol = len(ends) < maxlines and (not len(ends) or ends[-1] < size)
+  if noeol:
+    # last line in buffer without newline
+    ends = numpy.append(ends, size)
+  starts = numpy.empty_like(ends)
+  starts[0] = pos
+  starts[1:] = ends[:-1]
+
+  first = data[starts]
+  space = first == 32   # b" "
+  minus = first == 45   # b"-"
+  plus = first == 43    # b"+"
+  src = space | minus
+  tgt = space | plus
+  srcdone = numpy.cumsum(src)
+  tgtdone = numpy.cumsum(tgt)
+  srcbefore = srcdone - src
+  tgtbefore = tgtdone - tgt
+  valid = ((space & (srcbefore < srcleft) & (tgtbefore < tgtleft))
+           | (minus & (srcbefore < srcleft))
+           | (plus & (tgtbefore < tgtleft))
+           | (first == 92))   # b"\\"
+  complete = (srcdone == srcleft) & (tgtdone == tgtleft)
+
+  lines = len(starts)
+  invalid = numpy.flatnonzero(~valid)
+  firstinvalid = invalid[0] if len(invalid) else lines
+  done = numpy.flatnonzero(complete)
+  firstdone = done[0] if len(done) else lines
+  if firstdone < firstinvalid:
+    count = firstdone + 1
+    consumed = True
+  elif firstinvalid < lines:
+    count = firstinvalid
+    consumed = False
+  elif ends[-1] == size:
+    # end of buffer in the middle of hunk
+    count = lines
+    consumed = True
+  else:
+    return None
+
+  starts = starts[:count]
+  ends = ends[:count]
+  plus = plus[:count]
+  minus = minus[:count]
+  lengths = ends - starts - 1
+  delta = int(lengths[plus].sum()) - int(lengths[minus].sum())
+
+  # line ends - character before newline of every line
+  cr = 0
+  if noeol and count == lines:
+    cr = int(data[size-1] == 13)
+    withnl = ends[:-1] - 1
+    withnlstarts = starts[:-1]
+  else:
+    withnl = ends - 1
+    withnlstarts = starts
+  crlf = int(((withnl > withnlstarts) & (data[numpy.maximum(withnl - 1, 0)] == 13)).sum())
+  lf = len(withnl) - crlf
+
+  return (starts, int(ends[-1]) if count else pos,
+          srcleft - int(srcdone[count-1]) if count else srcleft,
+          tgtleft - int(tgtdone[count-1]) if count else tgtleft,
+          int(plus.sum()), int(minus.sum()), delta, crlf, lf, cr, consumed)
+
+
+def line_stats(text):
+  """ return (inserts, deletes, delta) for LineView lines """
+  data = _array(text.buffer)
+  if data is None:
+    return None
+  offsets = numpy.frombuffer(text.offsets, dtype="u%d" % text.offsets.itemsize)
+  if not len(offsets):
+    return 0, 0, 0
+  starts = offsets[:-1].astype(numpy.int64)
+  lengths = numpy.diff(offsets.astype(numpy.int64)) - 1
+  nonempty = lengths >= 0
+  first = numpy.where(nonempty, data[numpy.minimum(starts, len(data) - 1)], 0)
+  plus = first == 43
+  minus = first == 45
+  return (int(plus.sum()), int(minus.sum()),
+          int(lengths[plus].sum()) - int(lengths[minus].sum()))
@@ -0,0 +1,106 @@
+#------------------------------------------------
+# Parsing many patch files at once
+
+# Files are parsed in a pool of processes. Workers send back
+# only small ParseResult objects - with or without parsed
+# PatchSet - so a diffstat of the whole corpus can be built
+# without shipping patches between processes.
+
+import fnmatch
+import os
+
+from . import compress, patch
+
+
+class ParseResult(object):
+  """ Result of parsing one file of a batch. `ok` is what
+      fromfile() would report, `error` is a message if file
+      could not be read or decompressed. `stats` are PatchSet.stats() and
+      `patchset` is None if only stats were requested.
+  """
+
+  __slots__ = ('filename', 'ok', 'error', 'errors', 'warnings',
+               'stats', 'patchset')
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.ok = False
+    self.error = None
+    self.errors = 0
+    self.warnings = 0
+    self.stats = []
+    self.patchset = None
+
+  def __repr__(self):
+    return "<ParseResult %s ok=%s errors=%d>" % (self.filename, self.ok,
+                                                 self.errors)
+
+
+class BatchResult(list):
+  """ List of ParseResult objects in input order """
+
+  @property
+  def failed(self):
+    """ results of files that were not parsed successfully """
+    return [r for r in self if not r.ok]
+
+  def stats(self):
+    """ PatchSet.stats() of all files, summed by target """
+    return patch.merge_stats(s for r in self for s in r.stats)
+
+  def diffstat(self):
+    """ aggregate diffstat of all files as a string """
+    return patch.format_diffstat(self.stats())
+
+
+def _parse_one(args):
+  """ process pool worker for parse_files() """
+  filename, debugmode, statsonly = args
+  result = ParseResult(filename)
+  # without patchset in result hunk lines are not needed
+  patchset = patch.PatchSet(debugmode=debugmode, statsonly=statsonly)
+  try:
+    result.ok = patchset.parse_file(filename) == True
+  except (IOError, OSError) + compress.ERRORS as e:
+    result.error = str(e) or e.__class__.__name__
+    return result
+  result.errors = patchset.errors
+  result.warnings = patchset.warnings
+  result.stats = patchset.stats()
+  if not statsonly:
+    result.patchset = patchset
+  return result
+
+
+def parse_files(filenames, workers=None, debugmode=False, statsonly=False,
+                lg=None):
+  """ parse files with `workers` processes (in this process
+      if workers is not greater than 1) and return BatchResult
+  """
+  tasks = [(f, debugmode, statsonly) for f in filenames]
+  if workers and workers > 1 and len(tasks) > 1:
+    import concurrent.futures
+    # send files in batches to cut down interprocess traffic
+    chunksize = max(1, len(tasks) // (workers * 4))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+      results = BatchResult(pool.map(_parse_one, tasks, chunksize=chunksize))
+  else:
+    results = BatchResult(_parse_one(t) for t in tasks)
+  for r in results:
+    if r.patchset and lg:
+      r.patchset.logger = lg
+    if r.error and lg:
+      lg.warning("error reading %s: %s" % (r.filename, r.error))
+  return results
+
+
+def find_files(directory, pattern="*.patch", recursive=True):
+  """ return sorted list of files in directory that match
+      shell `pattern`
+  """
+  found = []
+  for root, dirs, files in os.walk(directory):
+    found.extend(os.path.join(root, f) for f in fnmatch.filter(files, pattern))
+    if not recursive:
+      break
+  return sorted(found)
@@ -0,0 +1,679 @@
+#------------------------------------------------
+# Buffer backed line storage
+
+# Line sources and sequences that work over one big buffer
+# (bytes or mmap) instead of keeping each line as separate
+# bytes object.
+
+import mmap
+import os
+import re
+import tempfile
+import threading
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from io import BytesIO
+
+try:
+  import lzma
+except ImportError:
+  lzma = None
+
+
+def offsets_array(size):
+  """ return empty array suitable for offsets into
+      buffer of the specified size
+  """
+  return array('I' if size < 2**32 else 'Q')
+
+
+class LineView(object):
+  """ Read-only sequence of lines stored in `buf` between
+      offsets. Line `i` is buf[offsets[i]:offsets[i+1]], so
+      `offsets` contains one more item than there are lines.
+      Lines are sliced out of the buffer only on access.
+  """
+
+  __slots__ = ('_buf', '_offsets')
+
+  def __init__(self, buf, offsets):
+    self._buf = buf
+    self._offsets = offsets
+
+  @property
+  def buffer(self):
+    """ underlying buffer """
+    return self._buf
+
+  @property
+  def offsets(self):
+    """ array of line offsets into buffer """
+    return self._offsets
+
+  def __len__(self):
+    return max(len(self._offsets) - 1, 0)
+
+  def __getitem__(self, idx):
+    if isinstance(idx, slice):
+      return [self[i] for i in range(*idx.indices(len(self)))]
+    if idx < 0:
+      idx += len(self)
+    if not 0 <= idx < len(self):
+      raise IndexError("line index out of range")
+    return self._buf[self._offsets[idx]:self._offsets[idx+1]]
+
+  def __iter__(self):
+    buf = self._buf
+    offsets = self._offsets
+    for i in range(len(offsets) - 1):
+      yield buf[offsets[i]:offsets[i+1]]
+
+  def __eq__(self, other):
+    try:
+      return len(self) == len(other) and list(self) == list(other)
+    except TypeError:
+      return NotImplemented
+
+  def __ne__(self, other):
+    res = self.__eq__(other)
+    return res if res is NotImplemented else not res
+
+  def __deepcopy__(self, memo):
+    # view is read-only, so it can be shared
+    return self
+
+  def tobytes(self):
+    """ return all lines joined, sliced from buffer at once """
+    offsets = self._offsets
+    if not len(offsets):
+      return b''
+    return self._buf[offsets[0]:offsets[-1]]
+
+  def __reduce__(self):
+    # pickle only the lines, not the whole underlying buffer
+    offsets = self._offsets
+    if not len(offsets):
+      return (self.__class__, (b'', offsets))
+    start = offsets[0]
+    rebased = offsets_array(offsets[-1] - start)
+    rebased.extend(o - start for o in offsets)
+    return (self.__class__, (bytes(self._buf[start:offsets[-1]]), rebased))
+
+  def __repr__(self):
+    return "%s(%r)" % (self.__class__.__name__, list(self))
+
+
+def pack_lines(lines):
+  """ pack list of lines into LineView over single joined
+      buffer with an array of line offsets
+  """
+  buf = b''.join(lines)
+  offsets = offsets_array(len(buf))
+  offsets.append(0)
+  pos = 0
+  for line in lines:
+    pos += len(line)
+    offsets.append(pos)
+  return LineView(buf, offsets)
+
+
+class LazyLines(object):
+  """ Sequence of hunk lines that are read from the `source`
+      (see source_for()) between `start` and `end` offsets on
+      first access. Empty lines are expanded the same way the
+      parser does it.
+  """
+
+  __slots__ = ('_source', '_start', '_end', '_lines')
+
+  def __init__(self, source, start, end):
+    self._source = source
+    self._start = start
+    self._end = end
+    self._lines = None
+
+  def _load(self):
+    if self._lines is None:
+      lines = []
+      for line in BufferReader(self._source.read(self._start, self._end)):
+        if line.strip(b"\r\n") == b"":
+          line = b" " + line
+        lines.append(line)
+      self._lines = pack_lines(lines)
+      self._source = None
+    return self._lines
+
+  @property
+  def loaded(self):
+    return self._lines is not None
+
+  def __len__(self):
+    return len(self._load())
+
+  def __getitem__(self, idx):
+    return self._load()[idx]
+
+  def __iter__(self):
+    return iter(self._load())
+
+  def __eq__(self, other):
+    return self._load() == other
+
+  def __ne__(self, other):
+    return self._load() != other
+
+  def __reduce__(self):
+    return self._load().__reduce__()
+
+  def __repr__(self):
+    return "%s(%r)" % (self.__class__.__name__, list(self))
+
+
+class SpooledLines(object):
+  """ Collects lines of a hunk in memory until they take more
+      than `threshold` bytes, then moves them to a temporary
+      file. finish() returns the lines as LineView or, if they
+      were spilled, as SpilledLines.
+  """
+
+  __slots__ = ('threshold', '_lines', '_size', '_count', '_file')
+
+  def __init__(self, threshold):
+    self.threshold = threshold
+    self._lines = []
+    self._size = 0
+    self._count = 0
+    self._file = None
+
+  def append(self, line):
+    self._count += 1
+    if self._file is not None:
+      self._file.write(line)
+      return
+    self._lines.append(line)
+    self._size += len(line)
+    if self._size > self.threshold:
+      self._file = tempfile.TemporaryFile(prefix="patcher-")
+      self._file.writelines(self._lines)
+      self._lines = None
+
+  def __len__(self):
+    return self._count
+
+  def finish(self):
+    if self._file is None:
+      return pack_lines(self._lines)
+    self._file.flush()
+    return SpilledLines(self._file, self._count)
+
+
+class NullLines(object):
+  """ Collector of hunk lines that only counts them, used
+      when lines are not kept
+  """
+
+  __slots__ = ('_count',)
+
+  def __init__(self):
+    self._count = 0
+
+  def append(self, line):
+    self._count += 1
+
+  def __len__(self):
+    return self._count
+
+
+class SpilledLines(object):
+  """ Read-only sequence of lines stored in temporary file.
+      Lines are read back block by block when iterated, every
+      iterator keeps its own position. Indexing has to scan
+      the file, so iterate when possible.
+  """
+
+  __slots__ = ('_file', '_count')
+
+  blocksize = 2**20
+
+  def __init__(self, fp, count):
+    self._file = fp
+    self._count = count
+
+  def __len__(self):
+    return self._count
+
+  def __iter__(self):
+    fp = self._file
+    pos = 0
+    pending = b""
+    while True:
+      fp.seek(pos)
+      block = fp.read(self.blocksize)
+      if not block:
+        break
+      pos += len(block)
+      block = pending + block
+      end = block.rfind(b"\n") + 1
+      pending = block[end:]
+      if end:
+        for line in BufferReader(block[:end]):
+          yield line
+    if pending:
+      yield pending
+
+  def __getitem__(self, idx):
+    if isinstance(idx, slice):
+      return list(self)[idx]
+    if idx < 0:
+      idx += len(self)
+    if not 0 <= idx < len(self):
+      raise IndexError("line index out of range")
+    for i, line in enumerate(self):
+      if i == idx:
+        return line
+
+  def __eq__(self, other):
+    try:
+      if len(self) != len(other):
+        return False
+    except TypeError:
+      return NotImplemented
+    return all(a == b for a, b in zip(self, other))
+
+  def __ne__(self, other):
+    res = self.__eq__(other)
+    return res if res is NotImplemented else not res
+
+  def __deepcopy__(self, memo):
+    # file is never modified, so it can be shared
+    return self
+
+  def __reduce__(self):
+    # pickled lines are loaded into memory
+    return pack_lines(list(self)).__reduce__()
+
+  def __repr__(self):
+    return "<%s %d lines>" % (self.__class__.__name__, len(self))
+
+  def __del__(self):
+    self._file.close()
+
+
+# (compress, decompress) functions for CompressedBlob methods
+COMPRESSORS = {
+  "zlib": (zlib.compress, zlib.decompress),
+}
+if lzma:
+  COMPRESSORS["lzma"] = (lzma.compress, lzma.decompress)
+
+
+class BlobCache(object):
+  """ LRU cache of decompressed CompressedBlob data. Keeps
+      up to `size` recently used blobs.
+  """
+
+  def __init__(self, size=8):
+    self.size = size
+    self._data = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, blob):
+    with self._lock:
+      data = self._data.get(blob)
+      if data is not None:
+        self._data.move_to_end(blob)
+        return data
+    data = blob.decompress()
+    with self._lock:
+      self._data[blob] = data
+      while len(self._data) > self.size:
+        self._data.popitem(last=False)
+    return data
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+
+
+# shared by all blobs
+blob_cache = BlobCache()
+
+
+class CompressedBlob(object):
+  """ Compressed lines of all hunks of one patch. Data is
+      decompressed on access and kept in blob_cache.
+  """
+
+  __slots__ = ('_data', '_method', 'size')
+
+  def __init__(self, data, method="zlib"):
+    if method not in COMPRESSORS:
+      raise ValueError("unsupported compression method: %s" % method)
+    self._data = COMPRESSORS[method][0](data)
+    self._method = method
+    self.size = len(data)   #: decompressed size
+
+  def __len__(self):
+    """ compressed size """
+    return len(self._data)
+
+  def decompress(self):
+    return COMPRESSORS[self._method][1](self._data)
+
+  def load(self):
+    """ return decompressed data """
+    return blob_cache.get(self)
+
+
+class CompressedLines(object):
+  """ Read-only sequence of hunk lines kept in CompressedBlob
+      between offsets (see LineView). Length is known without
+      decompressing.
+  """
+
+  __slots__ = ('_blob', '_offsets')
+
+  def __init__(self, blob, offsets):
+    self._blob = blob
+    self._offsets = offsets
+
+  def _view(self):
+    return LineView(self._blob.load(), self._offsets)
+
+  def __len__(self):
+    return max(len(self._offsets) - 1, 0)
+
+  def __getitem__(self, idx):
+    return self._view()[idx]
+
+  def __iter__(self):
+    return iter(self._view())
+
+  def __eq__(self, other):
+    return self._view() == other
+
+  def __ne__(self, other):
+    return self._view() != other
+
+  def __deepcopy__(self, memo):
+    # blob is never modified, so it can be shared
+    return self
+
+  def __reduce__(self):
+    return self._view().__reduce__()
+
+  def __repr__(self):
+    return "<%s %d lines>" % (self.__class__.__name__, len(self))
+
+
+def compress_hunks(hunks, method="zlib"):
+  """ move lines of `hunks` into single CompressedBlob, every
+      hunk text becomes CompressedLines over it
+  """
+  lines = []
+  bounds = []
+  size = 0
+  for hunk in hunks:
+    offsets = [size]
+    for line in hunk.text:
+      lines.append(line)
+      size += len(line)
+      offsets.append(size)
+    bounds.append(offsets)
+  blob = CompressedBlob(b"".join(lines), method)
+  del lines
+  for hunk, offsets in zip(hunks, bounds):
+    stats = hunk.inserts, hunk.deletes, hunk.delta, hunk.rawhead
+    packed = offsets_array(size)
+    packed.extend(offsets)
+    hunk.text = CompressedLines(blob, packed)
+    # text is the same, so are stats and @@ line
+    hunk.inserts, hunk.deletes, hunk.delta, hunk.rawhead = stats
+  return blob
+
+
+class FileSource(object):
+  """ Reads byte ranges from file, which is opened on every
+      access, so it is safe to keep around
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+
+  def read(self, start, end):
+    fp = open(self.filename, "rb")
+    try:
+      fp.seek(start)
+      return fp.read(end - start)
+    finally:
+      fp.close()
+
+  def lines(self, start, end):
+    return LazyLines(self, start, end)
+
+
+class StreamSource(FileSource):
+  """ Reads byte ranges from seekable stream """
+
+  def __init__(self, stream):
+    self.stream = stream
+
+  def read(self, start, end):
+    self.stream.seek(start)
+    return self.stream.read(end - start)
+
+
+class BufferSource(FileSource):
+  """ Reads byte ranges from buffer """
+
+  def __init__(self, buf):
+    self.buffer = buf
+
+  def read(self, start, end):
+    return self.buffer[start:end]
+
+
+def source_for(stream):
+  """ return FileSource-like object to read parsed stream
+      contents later or None if the stream is not seekable
+  """
+  if isinstance(stream, BufferReader):
+    return BufferSource(stream.buffer)
+  try:
+    if not stream.seekable():
+      return None
+  except (AttributeError, OSError, ValueError):
+    return None
+  name = getattr(stream, "name", None)
+  if isinstance(name, (str, bytes)) and os.path.isfile(name):
+    return FileSource(os.path.abspath(name))
+  return StreamSource(stream)
+
+
+def stream_offset(stream):
+  """ return current byte offset of stream or 0 if unknown """
+  try:
+    return stream.tell()
+  except (AttributeError, OSError, ValueError):
+    return 0
+
+
+class ByteView(object):
+  """ bytes-like wrapper around memoryview - adds find() and
+      makes slices return bytes. Nothing is copied except
+      for the sliced out parts.
+  """
+
+  __slots__ = ('_view',)
+
+  _patterns = {}
+
+  def __init__(self, view):
+    if view.ndim != 1 or view.itemsize != 1:
+      view = view.cast('B')
+    self._view = view
+
+  def __len__(self):
+    return len(self._view)
+
+  def __getitem__(self, idx):
+    if isinstance(idx, slice):
+      return self._view[idx].tobytes()
+    return self._view[idx]
+
+  def find(self, sub, start=0, end=None):
+    pattern = self._patterns.get(sub)
+    if pattern is None:
+      pattern = self._patterns[sub] = re.compile(re.escape(sub))
+    m = pattern.search(self._view, start, len(self._view) if end is None else end)
+    return m.start() if m else -1
+
+
+def as_buffer(data):
+  """ return `data` (bytes, bytearray, memoryview, mmap) as
+      buffer with find() and slicing that gives bytes. Note
+      that mutable buffers are not copied, so they must not
+      change while lines are in use.
+  """
+  if isinstance(data, (bytes, mmap.mmap, ByteView)):
+    return data
+  return ByteView(memoryview(data))
+
+
+class BufferReader(object):
+  """ File-like line iterator over a buffer (bytes, bytearray,
+      memoryview, mmap, see as_buffer()). Exposes the buffer to
+      the parser, which can then scan hunk bodies without making
+      copies of lines.
+  """
+
+  def __init__(self, buf):
+    self.buffer = as_buffer(buf)
+    self._pos = 0
+    self._size = len(buf)
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    pos = self._pos
+    if pos >= self._size:
+      raise StopIteration
+    eol = self.buffer.find(b"\n", pos)
+    end = self._size if eol < 0 else eol + 1
+    self._pos = end
+    return self.buffer[pos:end]
+
+  next = __next__
+
+  def tell(self):
+    return self._pos
+
+  def seek(self, pos):
+    self._pos = pos
+
+  def close(self):
+    pass
+
+
+class NeedMore(Exception):
+  """ raised by PushReader when no complete line is available
+      yet, but more data can be fed
+  """
+
+
+class LimitExceeded(Exception):
+  """ raised by LimitedReader when the next line doesn't fit
+      into bytes left
+  """
+
+
+class LimitedReader(object):
+  """ Line iterator over file-like object, which reads at most
+      `limit` bytes. Lines are read with readline() capped by
+      the bytes left, so a long line without newline is never
+      loaded in full - LimitExceeded is raised instead.
+  """
+
+  def __init__(self, stream, limit):
+    self._readline = stream.readline
+    self.left = limit
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    if self.left < 0:
+      raise LimitExceeded
+    line = self._readline(self.left + 1)
+    if not line:
+      raise StopIteration
+    self.left -= len(line)
+    if self.left < 0:
+      raise LimitExceeded
+    return line
+
+  next = __next__
+
+
+class PushReader(object):
+  """ Line iterator over chunks of bytes passed to feed().
+      Lines split between chunks are joined. Raises NeedMore
+      when fed lines are over, StopIteration after close().
+  """
+
+  def __init__(self):
+    self._lines = deque()
+    self._partial = []   # parts of unfinished last line
+    self.closed = False
+
+  def feed(self, data):
+    if not isinstance(data, bytes):
+      data = bytes(data)
+    eol = data.find(b"\n")
+    if eol < 0:
+      if data:
+        self._partial.append(data)
+      return
+    if self._partial:
+      self._partial.append(data[:eol+1])
+      self._lines.append(b"".join(self._partial))
+      self._partial = []
+    else:
+      self._lines.append(data[:eol+1])
+    end = data.rfind(b"\n") + 1
+    if end > eol + 1:
+      self._lines.extend(BytesIO(data[eol+1:end]))
+    if end < len(data):
+      self._partial.append(data[end:])
+
+  def close(self):
+    if self._partial:
+      self._lines.append(b"".join(self._partial))
+      self._partial = []
+    self.closed = True
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    if self._lines:
+      return self._lines.popleft()
+    if self.closed:
+      raise StopIteration
+    raise NeedMore
+
+  next = __next__
+
+
+def mapfile(fp):
+  """ map opened file into memory and return BufferReader
+      for it, or None if file can not be mapped (empty files,
+      pipes and the like)
+  """
+  try:
+    buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+  except (ValueError, OSError):
+    return None
+  return BufferReader(buf)
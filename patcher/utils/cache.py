@@ -0,0 +1,134 @@
+#------------------------------------------------
+# Persistent cache of parsed patch files
+
+# Parsed PatchSets are stored in a directory as compressed
+# pickles keyed by hash of patch file contents, so parsing
+# the same patch again only needs to read the cache entry.
+# Cache size is bounded, least recently used entries are
+# removed first (entry mtime is updated on every hit).
+
+import hashlib
+import os
+import pickle
+import tempfile
+import zlib
+
+from . import patch
+
+# bump when parser output changes, so that old entries
+# are not used anymore
+CACHE_VERSION = 3
+
+DEFAULT_MAXSIZE = 256 * 2**20   # bytes
+
+
+class ParseCache(object):
+  """ Directory with cached parse results. If total size of
+      entries exceeds `maxsize` bytes, oldest ones are evicted.
+  """
+
+  suffix = ".patchcache"
+
+  def __init__(self, directory, maxsize=DEFAULT_MAXSIZE, lg=None):
+    self.directory = directory
+    self.maxsize = maxsize
+    self.logger = lg
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def key(self, filename):
+    """ return cache key for contents of patch file """
+    digest = hashlib.sha256(("patcher-cache-%d\0" % CACHE_VERSION).encode())
+    fp = open(filename, "rb")
+    try:
+      for block in iter(lambda: fp.read(2**20), b""):
+        digest.update(block)
+    finally:
+      fp.close()
+    return digest.hexdigest()
+
+  def _path(self, key):
+    return os.path.join(self.directory, key + self.suffix)
+
+  def load(self, key, lg=None, debugmode=False):
+    """ return (result of parse(), PatchSet) for cached entry or
+        None if there is no such entry or it can not be used
+    """
+    path = self._path(key)
+    try:
+      fp = open(path, "rb")
+    except (IOError, OSError):
+      return None
+    try:
+      data = pickle.loads(zlib.decompress(fp.read()))
+    except Exception:
+      data = None
+    finally:
+      fp.close()
+    if not data or data[0] != CACHE_VERSION:
+      self._debug("ignoring stale cache entry %s" % path)
+      return None
+
+    version, res, ptype, errors, warnings, items, trailer = data
+    kwargs = dict(debugmode=debugmode)
+    if lg:
+      kwargs["lg"] = lg
+    patchset = patch.PatchSet(**kwargs)
+    patchset.type = ptype
+    patchset.errors = errors
+    patchset.warnings = warnings
+    patchset.items = items
+    patchset._trailer = trailer
+    # mark entry as recently used
+    try:
+      os.utime(path, None)
+    except OSError:
+      pass
+    self._debug("loaded %s from cache" % key)
+    return res, patchset
+
+  def store(self, key, res, patchset):
+    """ store result of parse() and parsed PatchSet """
+    data = (CACHE_VERSION, res, patchset.type, patchset.errors,
+            patchset.warnings, patchset.items, patchset._trailer)
+    blob = zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL), 1)
+    fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+    try:
+      with os.fdopen(fd, "wb") as fp:
+        fp.write(blob)
+      os.replace(tmpname, self._path(key))
+    except Exception:
+      if os.path.exists(tmpname):
+        os.unlink(tmpname)
+      raise
+    self.evict()
+
+  def evict(self):
+    """ remove least recently used entries until total size
+        of cache is below maxsize
+    """
+    entries = []
+    total = 0
+    for name in os.listdir(self.directory):
+      if not name.endswith(self.suffix):
+        continue
+      path = os.path.join(self.directory, name)
+      try:
+        st = os.stat(path)
+      except OSError:
+        continue
+      entries.append((st.st_mtime, st.st_size, path))
+      total += st.st_size
+    entries.sort()
+    while total > self.maxsize and entries:
+      mtime, size, path = entries.pop(0)
+      self._debug("evicting %s from cache" % path)
+      try:
+        os.unlink(path)
+      except OSError:
+        pass
+      total -= size
+
+  def _debug(self, msg):
+    if self.logger:
+      self.logger.debug(msg)
@@ -0,0 +1,78 @@
+#------------------------------------------------
+# Compressed patch input
+
+# Compression is detected by magic bytes at the start of
+# stream, which is then wrapped into stdlib decompressing
+# file object. Lines are decompressed as the parser reads
+# them, nothing is inflated to memory or disk as a whole.
+# bz2 and lzma modules are optional in Python builds.
+
+import gzip
+import zlib
+
+try:
+  import bz2
+except ImportError:
+  bz2 = None
+
+try:
+  import lzma
+except ImportError:
+  lzma = None
+
+
+# (name, magic bytes, module)
+FORMATS = [
+  ("gzip", b"\x1f\x8b", gzip),
+  ("bzip2", b"BZh", bz2),
+  ("xz", b"\xfd7zXZ\x00", lzma),
+]
+
+MAGIC_SIZE = max(len(magic) for name, magic, module in FORMATS)
+
+# raised while reading truncated or corrupt compressed data,
+# besides OSError (gzip, bz2)
+ERRORS = (EOFError, zlib.error)
+if lzma:
+  ERRORS += (lzma.LZMAError,)
+
+
+def detect(head):
+  """ return name of compression format for the first bytes
+      of stream or None if it is not compressed
+  """
+  for name, magic, module in FORMATS:
+    if head.startswith(magic):
+      return name
+  return None
+
+
+def peek(fp, size=MAGIC_SIZE):
+  """ return first `size` bytes of stream without consuming
+      them. Non-seekable streams must support peek(), like
+      sys.stdin.buffer does.
+  """
+  if hasattr(fp, "peek"):
+    return fp.peek(size)[:size]
+  pos = fp.tell()
+  head = fp.read(size)
+  fp.seek(pos)
+  return head
+
+
+def open_stream(fp):
+  """ return (stream, format) for binary file object `fp`.
+      If `fp` is compressed, stream decompresses it on the
+      fly, otherwise it is `fp` itself and format is None.
+      Raises IOError if module for the format is missing.
+  """
+  name = detect(peek(fp))
+  if name is None:
+    return fp, None
+  if name == "gzip":
+    return gzip.GzipFile(fileobj=fp, mode="rb"), name
+  if name == "bzip2" and bz2:
+    return bz2.BZ2File(fp), name
+  if name == "xz" and lzma:
+    return lzma.LZMAFile(fp), name
+  raise IOError("%s compressed input is not supported by this Python" % name)
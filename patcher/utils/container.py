@@ -0,0 +1,194 @@
+#------------------------------------------------
+# Compact binary container for parsed patches
+
+# Container keeps parsed PatchSet in a form that can be loaded
+# with a single read (or mmap) and a few struct unpacks, without
+# parsing unified diff again.
+#
+# Layout (all integers are little-endian):
+#
+#   header     HEADER  magic b"PTCH", format version, patchset
+#                      type, offset width (4 or 8), number of
+#                      files, hunks and strings, errors, warnings,
+#                      first trailer string and number of trailer
+#                      lines (unparsed data at the end of patch)
+#   file table FILE    one record per Patch: type, source and
+#                      target string index, first header string
+#                      and header length, first hunk and number
+#                      of hunks, crlf/lf/cr line end counts,
+#                      string index of raw "---" and "+++" lines
+#                      (empty strings if unknown)
+#   hunk table HUNK    one record per Hunk: startsrc, linessrc,
+#                      starttgt, linestgt, invalid flag, desc
+#                      string index, first line string and number
+#                      of lines, inserts (-1 if stats are
+#                      unknown), deletes, delta, string index of
+#                      raw @@ line (empty string if unknown)
+#   offsets            (strings + 1) offsets of every string,
+#                      relative to the start of container
+#   blob               all strings - header lines, filenames, hunk
+#                      descriptions and @@ lines, hunk lines and trailer lines -
+#                      one after another
+#
+# String `i` is container[offsets[i]:offsets[i+1]]. Lines of each
+# hunk are stored next to each other, so hunk text is a LineView
+# over loaded data with a slice of offsets.
+
+import struct
+import sys
+from array import array
+
+from . import variables
+from .buffers import LineView, mapfile
+from .dataobjects import Hunk, Patch
+
+MAGIC = b"PTCH"
+VERSION = 3
+
+HEADER = struct.Struct("<4sHBBIIIIIII")
+FILE = struct.Struct("<BIIIIIIIIIII")
+HUNK = struct.Struct("<IIIIBIIIiiqI")
+
+TYPES = [None, variables.PLAIN, variables.GIT, variables.HG,
+         variables.SVN, variables.MIXED]
+
+
+def _offsets(width):
+  return array('I' if width == 4 else 'Q')
+
+
+def save(patchset, filename):
+  """ write PatchSet into container file """
+  strings = []     # blob parts
+  sizes = []       # their lengths
+  files = []
+  hunks = []
+
+  def add(s):
+    strings.append(s)
+    sizes.append(len(s))
+    return len(strings) - 1
+
+  for p in patchset.items:
+    headerstart = len(strings)
+    for line in p.header:
+      add(line)
+    source = add(p.source)
+    target = add(p.target)
+    hunkstart = len(hunks)
+    for h in p.hunks:
+      desc = add(h.desc or b'')
+      rawhead = add(h.rawhead or b'')
+      linestart = len(strings)
+      for line in h.text:
+        add(line)
+      hunks.append((h.startsrc or 0, h.linessrc or 0, h.starttgt or 0,
+                    h.linestgt or 0, bool(h.invalid), desc, linestart,
+                    len(strings) - linestart,
+                    -1 if h.inserts is None else h.inserts,
+                    h.deletes or 0, h.delta or 0, rawhead))
+    ends = p.hunkends or {}
+    rawnames = p.rawnames or (b'', b'')
+    files.append((TYPES.index(p.type), source, target, headerstart,
+                  len(p.header), hunkstart, len(p.hunks),
+                  ends.get("crlf", 0), ends.get("lf", 0), ends.get("cr", 0),
+                  add(rawnames[0]), add(rawnames[1])))
+  trailerstart = len(strings)
+  for line in patchset._trailer:
+    add(line)
+
+  blobsize = sum(sizes)
+  width = 4
+  tablesize = (HEADER.size + FILE.size * len(files)
+               + HUNK.size * len(hunks))
+  if tablesize + (len(strings) + 1) * 8 + blobsize >= 2**32:
+    width = 8
+  offsets = _offsets(width)
+  pos = tablesize + (len(strings) + 1) * width
+  offsets.append(pos)
+  for size in sizes:
+    pos += size
+    offsets.append(pos)
+  if sys.byteorder == "big":
+    offsets.byteswap()
+
+  fp = open(filename, "wb")
+  try:
+    fp.write(HEADER.pack(MAGIC, VERSION, TYPES.index(patchset.type), width,
+                         len(files), len(hunks), len(strings),
+                         patchset.errors, patchset.warnings,
+                         trailerstart, len(patchset._trailer)))
+    fp.writelines(FILE.pack(*f) for f in files)
+    fp.writelines(HUNK.pack(*h) for h in hunks)
+    fp.write(offsets.tobytes())
+    fp.writelines(strings)
+  finally:
+    fp.close()
+
+
+def load(filename, patchset, mmap=False):
+  """ fill empty PatchSet from container file
+
+      return True on success, False if file is not a container
+  """
+  fp = open(filename, "rb")
+  try:
+    reader = mapfile(fp) if mmap else None
+    data = reader.buffer if reader else fp.read()
+  finally:
+    fp.close()
+
+  if len(data) < HEADER.size:
+    return False
+  (magic, version, ptype, width, nfiles, nhunks, nstrings,
+   errors, warnings, trailerstart, trailerlen) = HEADER.unpack_from(data, 0)
+  if magic != MAGIC or version != VERSION:
+    return False
+
+  pos = HEADER.size
+  view = memoryview(data)
+  files = list(struct.iter_unpack(FILE.format, view[pos:pos + FILE.size * nfiles]))
+  pos += FILE.size * nfiles
+  hunkrecs = list(struct.iter_unpack(HUNK.format, view[pos:pos + HUNK.size * nhunks]))
+  pos += HUNK.size * nhunks
+  offsets = _offsets(width)
+  offsets.frombytes(view[pos:pos + (nstrings + 1) * width])
+  if sys.byteorder == "big":
+    offsets.byteswap()
+  view.release()
+
+  def string(i):
+    return data[offsets[i]:offsets[i+1]]
+
+  items = []
+  for (ftype, source, target, headerstart, headerlen, hunkstart, hunkcount,
+       crlf, lf, cr, srcline, tgtline) in files:
+    p = Patch()
+    p.type = TYPES[ftype]
+    p.source = string(source)
+    p.target = string(target)
+    p.header = [string(i) for i in range(headerstart, headerstart + headerlen)]
+    p.hunkends = dict(crlf=crlf, lf=lf, cr=cr)
+    if offsets[srcline] != offsets[srcline+1]:
+      p.rawnames = (string(srcline), string(tgtline))
+    for rec in hunkrecs[hunkstart:hunkstart + hunkcount]:
+      h = Hunk()
+      (h.startsrc, h.linessrc, h.starttgt, h.linestgt, invalid, desc,
+       linestart, linecount, inserts, deletes, delta, rawhead) = rec
+      h.invalid = bool(invalid)
+      h.desc = string(desc)
+      h.text = LineView(data, offsets[linestart:linestart + linecount + 1])
+      if offsets[rawhead] != offsets[rawhead+1]:
+        h.rawhead = string(rawhead)
+      if inserts >= 0:
+        h.inserts, h.deletes, h.delta = inserts, deletes, delta
+      p.hunks.append(h)
+    items.append(p)
+
+  patchset.items = items
+  patchset.type = TYPES[ptype]
+  patchset.errors = errors
+  patchset.warnings = warnings
+  patchset._trailer = [string(i) for i in range(trailerstart,
+                                                trailerstart + trailerlen)]
+  return True
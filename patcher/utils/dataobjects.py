@@ -1,6 +1,14 @@
+from . import accel
+from .buffers import LineView, SpooledLines, pack_lines
+
+
 class Hunk(object):
   """ Parsed hunk data container (hunk starts with @@ -R +R @@) """
 
+  __slots__ = ('startsrc', 'linessrc', 'starttgt', 'linestgt',
+               'invalid', 'desc', 'rawhead', '_text', 'inserts', 'deletes',
+               'delta')
+
   def __init__(self):
     self.startsrc=None #: line count starts with 1
     self.linessrc=None
@@ -8,7 +16,57 @@ class Hunk(object):
     self.linestgt=None
     self.invalid=False
     self.desc=''
+    # @@ line as it is in patch, None if unknown (set after text)
     self.text=[]
+    self.rawhead=None
+    # line stats gathered by parser, None if unknown
+    # (reset when text is changed)
+    self.inserts=None
+    self.deletes=None
+    self.delta=None   #: size change in bytes
+
+  @property
+  def text(self):
+    """ read-only sequence of hunk lines (bytes). Assigned lists
+        are packed into one buffer with an offsets table, big
+        hunks collected in SpooledLines stay in temporary file.
+    """
+    return self._text
+
+  @text.setter
+  def text(self, lines):
+    if isinstance(lines, list):
+      lines = pack_lines(lines)
+    elif isinstance(lines, SpooledLines):
+      lines = lines.finish()
+    self._text = lines
+    # changed text invalidates stats and @@ line
+    self.inserts = self.deletes = self.delta = None
+    self.rawhead = None
+
+  def stats(self):
+    """ return (insertions, deletions, size change in bytes).
+        Stats not gathered by parser are counted from lines
+        once and stored.
+    """
+    if self.inserts is None:
+      text = self._text
+      counted = None
+      if accel.numpy is not None and isinstance(text, LineView) \
+         and len(text) >= accel.MIN_LINES:
+        counted = accel.line_stats(text)
+      if counted is None:
+        inserts = deletes = delta = 0
+        for line in text:
+          if line.startswith(b'+'):
+            inserts += 1
+            delta += len(line) - 1
+          elif line.startswith(b'-'):
+            deletes += 1
+            delta -= len(line) - 1
+        counted = inserts, deletes, delta
+      self.inserts, self.deletes, self.delta = counted
+    return self.inserts, self.deletes, self.delta
 
 #  def apply(self, estream):
 #    """ write hunk data into enumerable stream
@@ -25,9 +83,15 @@ class Patch(object):
   """ Patch for a single file.
       If used as an iterable, returns hunks.
   """
+
+  __slots__ = ('source', 'target', 'hunks', 'hunkends', 'header', 'type',
+               'rawnames')
+
   def __init__(self):
-    self.source = None 
+    self.source = None
     self.target = None
+    # (--- line, +++ line) as they are in patch, None if unknown
+    self.rawnames = None
     self.hunks = []
     self.hunkends = []
     self.header = []
@@ -36,4 +100,47 @@ class Patch(object):
 
   def __iter__(self):
     for h in self.hunks:
-      yield h
\ No newline at end of file
+      yield h
+
+  def stats(self):
+    """ return (insertions, deletions, size change in bytes)
+        summed over hunks
+    """
+    inserts = deletes = delta = 0
+    for h in self.hunks:
+      i, d, size = h.stats()
+      inserts += i
+      deletes += d
+      delta += size
+    return inserts, deletes, delta
+
+class Limits(object):
+  """ Resource limits for parsing untrusted patches. Parser
+      stops when one is exceeded, logs an error and records
+      limit name in PatchSet.limited. None means no limit.
+
+      max_bytes        - bytes read from stream
+      max_files        - file diffs (including filtered out)
+      max_hunks        - hunks in all files
+      max_hunk_lines   - source plus target lines of a hunk
+                         as declared in @@ header
+      max_header_lines - header lines before a file diff
+      max_time         - seconds spent parsing
+  """
+
+  __slots__ = ('max_bytes', 'max_files', 'max_hunks', 'max_hunk_lines',
+               'max_header_lines', 'max_time')
+
+  def __init__(self, max_bytes=None, max_files=None, max_hunks=None,
+               max_hunk_lines=None, max_header_lines=None, max_time=None):
+    self.max_bytes = max_bytes
+    self.max_files = max_files
+    self.max_hunks = max_hunks
+    self.max_hunk_lines = max_hunk_lines
+    self.max_header_lines = max_header_lines
+    self.max_time = max_time
+
+  def __repr__(self):
+    return "Limits(%s)" % ", ".join("%s=%r" % (name, getattr(self, name))
+                                    for name in self.__slots__
+                                    if getattr(self, name) is not None)
@@ -0,0 +1,66 @@
+#------------------------------------------------
+# Structured export of parsed patches
+
+# Patches are turned into flat records - one for every file
+# diff followed by one for each of its hunks - and written as
+# newline delimited JSON. Records are produced while patches
+# are parsed, so output of any size is written incrementally.
+#
+# {"record": "file", "file": 0, "source": ..., "target": ...,
+#  "type": "git", "hunks": 2, "inserts": 3, "deletes": 1,
+#  "delta": 42}
+# {"record": "hunk", "file": 0, "hunk": 0, "startsrc": 10,
+#  "linessrc": 7, "starttgt": 10, "linestgt": 9, "desc": ...,
+#  "invalid": false, "inserts": 2, "deletes": 0, "delta": 30,
+#  "lines": [...]}   <- only if lines are requested
+#
+# Filenames and lines are utf-8 strings with surrogate escapes
+# for undecodable bytes.
+
+import json
+
+
+def _tostr(data):
+  return data.decode("utf-8", "surrogateescape")
+
+
+def records(patches, lines=False):
+  """ yield (file record, [hunk records]) for every Patch
+      of `patches` iterable, with hunk lines if `lines`
+  """
+  for fileno, p in enumerate(patches):
+    hunks = []
+    total = [0, 0, 0]
+    for hunkno, hunk in enumerate(p.hunks):
+      stats = hunk.stats()
+      for i in range(3):
+        total[i] += stats[i]
+      record = dict(record="hunk", file=fileno, hunk=hunkno,
+                    startsrc=hunk.startsrc, linessrc=hunk.linessrc,
+                    starttgt=hunk.starttgt, linestgt=hunk.linestgt,
+                    desc=_tostr(hunk.desc), invalid=hunk.invalid,
+                    inserts=stats[0], deletes=stats[1], delta=stats[2])
+      if lines:
+        record["lines"] = [_tostr(line) for line in hunk.text]
+      hunks.append(record)
+    filerecord = dict(record="file", file=fileno, source=_tostr(p.source),
+                      target=_tostr(p.target), type=p.type, hunks=len(hunks),
+                      inserts=total[0], deletes=total[1], delta=total[2])
+    yield filerecord, hunks
+
+
+def write_ndjson(patches, fp, lines=False):
+  """ write records of `patches` as NDJSON into binary stream
+      `fp`, one write call per file diff
+
+      return number of written file records
+  """
+  encode = json.JSONEncoder(separators=(",", ":")).encode
+  count = 0
+  for filerecord, hunks in records(patches, lines):
+    chunk = [encode(filerecord)]
+    chunk.extend(encode(r) for r in hunks)
+    chunk.append("")
+    fp.write("\n".join(chunk).encode("ascii"))
+    count += 1
+  return count
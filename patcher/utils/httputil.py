@@ -0,0 +1,196 @@
+#------------------------------------------------
+# Fetching patches over HTTP
+
+# Response bodies are decoded (gzip, deflate) while they are
+# read, so the parser gets lines as soon as they arrive and
+# compressed patches are never inflated in memory as a whole.
+# ConnectionPool keeps HTTP/1.1 connections open between
+# requests to the same host, so batch fetches do not pay a
+# TCP (and TLS) handshake for every patch.
+
+import http.client
+import threading
+import urllib.error
+import urllib.request
+import zlib
+from urllib.parse import urljoin, urlsplit
+
+from .buffers import BufferReader
+
+DEFAULT_TIMEOUT = 30      # seconds
+DEFAULT_BUFSIZE = 2**16   # bytes read from socket at once
+MAX_REDIRECTS = 5
+
+HEADERS = {"Accept-Encoding": "gzip, deflate"}
+
+
+class DecodingReader(object):
+  """ Line iterator over HTTP response. Body is read in blocks
+      of `bufsize` bytes and decoded according to
+      Content-Encoding `encoding` (gzip, deflate or identity).
+  """
+
+  def __init__(self, response, encoding=None, bufsize=DEFAULT_BUFSIZE):
+    self.response = response
+    self.bufsize = bufsize
+    encoding = (encoding or "identity").strip().lower()
+    if encoding in ("gzip", "x-gzip"):
+      self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == "deflate":
+      self._decoder = zlib.decompressobj()
+    elif encoding == "identity":
+      self._decoder = None
+    else:
+      raise IOError("unsupported Content-Encoding: %s" % encoding)
+    self._deflate = encoding == "deflate"
+    self._lines = self._iterlines()
+
+  def _blocks(self):
+    """ yield decoded blocks of response body """
+    first = True
+    while True:
+      data = self.response.read(self.bufsize)
+      if not data:
+        break
+      if self._decoder:
+        if first and self._deflate:
+          try:
+            data = self._decoder.decompress(data)
+          except zlib.error:
+            # some servers send raw deflate stream without zlib header
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = self._decoder.decompress(data)
+        else:
+          data = self._decoder.decompress(data)
+      first = False
+      if data:
+        yield data
+    if self._decoder:
+      data = self._decoder.flush()
+      if data:
+        yield data
+
+  def _iterlines(self):
+    pending = b""
+    for block in self._blocks():
+      block = pending + block
+      end = block.rfind(b"\n") + 1
+      pending = block[end:]
+      if end:
+        for line in BufferReader(block[:end]):
+          yield line
+    if pending:
+      yield pending
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    return next(self._lines)
+
+  next = __next__
+
+  def close(self):
+    self.response.close()
+
+
+def urlopen(url, timeout=DEFAULT_TIMEOUT, bufsize=DEFAULT_BUFSIZE):
+  """ open URL with urllib and return DecodingReader for it """
+  request = urllib.request.Request(url, headers=HEADERS)
+  response = urllib.request.urlopen(request, timeout=timeout)
+  encoding = response.headers.get("Content-Encoding")
+  return DecodingReader(response, encoding, bufsize)
+
+
+class ConnectionPool(object):
+  """ Keep-alive HTTP connections to be reused between requests.
+      Every thread gets its own connection per host, so the
+      pool can be shared by threads fetching in parallel.
+  """
+
+  def __init__(self, timeout=DEFAULT_TIMEOUT, bufsize=DEFAULT_BUFSIZE):
+    self.timeout = timeout
+    self.bufsize = bufsize
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    self._all = []
+
+  def _connection(self, scheme, netloc, fresh=False):
+    conns = getattr(self._local, "conns", None)
+    if conns is None:
+      conns = self._local.conns = {}
+    key = (scheme, netloc)
+    conn = conns.get(key)
+    if conn is not None and fresh:
+      conn.close()
+      conn = None
+    if conn is None:
+      cls = http.client.HTTPSConnection if scheme == "https" \
+              else http.client.HTTPConnection
+      conn = cls(netloc, timeout=self.timeout)
+      conns[key] = conn
+      with self._lock:
+        self._all.append(conn)
+    return conn
+
+  def _request(self, url):
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+      path += "?" + parts.query
+    conn = self._connection(parts.scheme, parts.netloc)
+    try:
+      conn.request("GET", path, headers=HEADERS)
+      return conn, conn.getresponse()
+    except (http.client.RemoteDisconnected, ConnectionError,
+            http.client.CannotSendRequest):
+      # server closed idle keep-alive connection, retry once
+      conn = self._connection(parts.scheme, parts.netloc, fresh=True)
+      conn.request("GET", path, headers=HEADERS)
+      return conn, conn.getresponse()
+
+  def open(self, url):
+    """ send GET request for URL and return DecodingReader for
+        the response. Raises urllib.error.HTTPError for error
+        statuses, like urlopen() does. Schemes other than http
+        and https are opened with urllib.
+    """
+    if urlsplit(url).scheme not in ("http", "https"):
+      return urlopen(url, self.timeout, self.bufsize)
+    for redirect in range(MAX_REDIRECTS + 1):
+      conn, response = self._request(url)
+      if response.status in (301, 302, 303, 307, 308) and \
+         response.getheader("Location"):
+        response.read()
+        url = urljoin(url, response.getheader("Location"))
+        continue
+      break
+    if response.status != 200:
+      response.read()
+      raise urllib.error.HTTPError(url, response.status, response.reason,
+                                   response.msg, None)
+    encoding = response.getheader("Content-Encoding")
+    return PooledReader(conn, response, encoding, self.bufsize)
+
+  def close(self):
+    """ close all connections made by the pool """
+    with self._lock:
+      conns, self._all = self._all, []
+    for conn in conns:
+      conn.close()
+
+
+class PooledReader(DecodingReader):
+  """ DecodingReader that keeps its connection usable for the
+      next request if the response was read completely
+  """
+
+  def __init__(self, conn, response, encoding, bufsize):
+    self.conn = conn
+    DecodingReader.__init__(self, response, encoding, bufsize)
+
+  def close(self):
+    if not self.response.isclosed():
+      # body is not consumed, connection can't be reused
+      self.response.close()
+      self.conn.close()
@@ -0,0 +1,171 @@
+#------------------------------------------------
+# Sidecar offset index for patch files
+
+# Index records byte offsets of every file diff in a patch -
+# start of its header, "---" filename line, "@@" hunk lines
+# and end - and is saved as JSON next to the patch file. With
+# the index, diffs of selected files are read and parsed
+# without scanning the rest of the patch.
+#
+# {"version": 1, "size": patch size, "mtime": mtime in ns,
+#  "files": [{"source": ..., "target": ..., "header": offset,
+#             "filenames": offset, "hunks": [offsets],
+#             "end": offset}, ...]}
+#
+# Filenames are normalized ones (as in parsed PatchSet), bytes
+# are stored as utf-8 strings with surrogate escapes.
+
+import json
+import os
+
+from . import buffers, compress, patch, variables
+
+INDEX_VERSION = 2
+SUFFIX = ".patchidx"
+
+
+def _tostr(name):
+  return name.decode("utf-8", "surrogateescape")
+
+
+def _tobytes(name):
+  return name.encode("utf-8", "surrogateescape")
+
+
+def _stamp(filename):
+  st = os.stat(filename)
+  return st.st_size, st.st_mtime_ns
+
+
+def build(filename, lg=patch.default_logger, debugmode=False):
+  """ parse patch file and return its index (dict) """
+  size, mtime = _stamp(filename)
+  # lazy parse only records where hunk lines are
+  patchset = patch.PatchSet(lg=lg, debugmode=debugmode, lazy=True)
+  patchset.offsets = []
+  fp = open(filename, "rb")
+  try:
+    if compress.detect(compress.peek(fp)):
+      raise IOError("compressed patch can not be indexed - %s" % filename)
+    names = [(p.source, p.target) for p in patchset.iterparse(fp)]
+  finally:
+    fp.close()
+
+  files = []
+  header = 0
+  for (source, target), (filenames, hunks, end) in zip(names, patchset.offsets):
+    if end is None:
+      # patch without valid hunks
+      end = filenames
+    # header can't overlap with filename lines
+    header = min(header, filenames)
+    files.append(dict(source=_tostr(source), target=_tostr(target),
+                      header=header, filenames=filenames, hunks=hunks,
+                      end=end))
+    header = end
+  return dict(version=INDEX_VERSION, size=size, mtime=mtime, files=files)
+
+
+def path_for(filename):
+  """ return name of sidecar index file for patch file """
+  return filename + SUFFIX
+
+
+def save(index, path):
+  fp = open(path, "w")
+  try:
+    json.dump(index, fp, separators=(",", ":"))
+  finally:
+    fp.close()
+
+
+def load(path):
+  """ return index saved at path or None if it can't be used """
+  try:
+    fp = open(path, "r")
+  except (IOError, OSError):
+    return None
+  try:
+    index = json.load(fp)
+  except ValueError:
+    return None
+  finally:
+    fp.close()
+  if not isinstance(index, dict) or index.get("version") != INDEX_VERSION:
+    return None
+  return index
+
+
+class PatchIndex(object):
+  """ Patch file with offset index of its file diffs, see
+      PatchSet.open_indexed(). Iterating returns (source,
+      target) filenames of indexed diffs.
+  """
+
+  def __init__(self, filename, index, lg=patch.default_logger, debugmode=False):
+    self.filename = filename
+    self.logger = lg
+    self.debugmode = debugmode
+    self.files = index["files"]
+    self._names = [(_tobytes(f["source"]), _tobytes(f["target"]))
+                   for f in self.files]
+
+  def __len__(self):
+    return len(self.files)
+
+  def __iter__(self):
+    return iter(self._names)
+
+  def find(self, name):
+    """ return index entries for diffs with source or target
+        filename `name` (bytes)
+    """
+    return [self.files[i] for i, names in enumerate(self._names)
+            if name in names]
+
+  def load(self, names=None):
+    """ read and parse diffs for files in `names` (all if None)
+        and return PatchSet with them
+    """
+    if names is None:
+      entries = self.files
+    else:
+      entries = []
+      for name in names:
+        entries.extend(e for e in self.find(name) if e not in entries)
+      entries.sort(key=lambda e: e["header"])
+
+    result = patch.PatchSet(lg=self.logger, debugmode=self.debugmode)
+    fp = open(self.filename, "rb")
+    try:
+      for entry in entries:
+        fp.seek(entry["header"])
+        data = fp.read(entry["end"] - entry["header"])
+        part = patch.PatchSet(lg=self.logger, debugmode=self.debugmode)
+        for p in part.iterparse(buffers.BufferReader(data)):
+          result.items.append(p)
+        result.errors += part.errors
+        result.warnings += part.warnings
+        if result.type is None:
+          result.type = part.type
+        elif part.type is not None and result.type != part.type:
+          result.type = variables.MIXED
+    finally:
+      fp.close()
+    return result
+
+
+def open_index(filename, lg=patch.default_logger, debugmode=False):
+  """ return PatchIndex for patch file. Sidecar index is
+      built and saved if it is missing or patch has changed.
+  """
+  path = path_for(filename)
+  index = load(path)
+  if index is None or (index["size"], index["mtime"]) != _stamp(filename):
+    lg.debug("indexing %s" % filename)
+    index = build(filename, lg, debugmode)
+    try:
+      save(index, path)
+    except (IOError, OSError) as e:
+      lg.warning("can't save index %s: %s" % (path, e))
+  return PatchIndex(filename, index, lg, debugmode)
@@ -9,7 +9,7 @@ import re
 
 from io import BytesIO as StringIO
 import urllib.request as urllib_request
-from . import dataobjects, variables, pathutil, logger
+from . import accel, buffers, compress, container, dataobjects, variables, pathutil, logger
 from os.path import exists, isfile, abspath
 import os
 import posixpath
@@ -26,12 +26,33 @@ def tostr(b):
   #     information loss
   return b.decode('utf-8')
 
+# logger of PatchSets created without one and unpickled ones
+default_logger = logger.Log()
+
+# yielded by PatchSet._iterparse() when push stream needs more data
+NEED_MORE = object()
+
+# regexp to match start of hunk, used groups - 1,3,4,6
+re_hunk_start = re.compile(b"^@@ -(\d+)(,(\d+))? \+(\d+)(,(\d+))? @@")
+# full hunk header, used groups - 1,3,4,6,7
+re_hunk_head = re.compile(b"^@@ -(\d+)(,(\d+))? \+(\d+)(,(\d+))? @@(.*)")
+# valid hunk body line
+re_hunk_line = re.compile(b"^[- \\+\\\\]")
+re_source = re.compile(b"^--- ([^\t]+)")
+re_target = re.compile(b"^\+\+\+ ([^\t]+)")
+
+# discards messages about filenames checked by _raw_names()
+_silent_logger = logger.Log(__name__ + ".silent")
+_silent_logger.logger.disabled = True
+
 class PatchSet(object):
   """ PatchSet is a patch parser and container.
       When used as an iterable, returns patches.
   """
 
-  def __init__(self, stream=None, lg=logger.Log(), debugmode=False):
+  def __init__(self, stream=None, lg=default_logger, debugmode=False, lazy=False,
+               spillsize=None, include=None, exclude=None, limits=None,
+               statsonly=False):
     # --- API accessible fields ---
 
     # name of the PatchSet (filename or ...)
@@ -44,9 +65,29 @@ class PatchSet(object):
 
     self.errors = 0    # fatal parsing errors
     self.warnings = 0  # non-critical warnings
+    self.skipped = 0   # file diffs filtered out by include/exclude
+    self.limited = None  # name of exceeded limit if parsing was stopped
     # --- /API ---
     self.logger = lg
     self.debugmode = debugmode
+    # consume hunk bodies in bulk using @@ line counts
+    self.fastpath = True
+    # keep only offsets of hunk bodies and read them on access
+    self.lazy = lazy
+    # hunks bigger than this many bytes are kept in temporary files
+    self.spillsize = spillsize
+    # keep only line stats of hunks, their text is left empty
+    self.statsonly = statsonly
+    # shell patterns to select file diffs by filename, hunks of
+    # other files are skipped without storing them
+    self.include = include
+    self.exclude = exclude
+    # dataobjects.Limits to stop parsing of too big or slow input
+    self.limits = limits
+    # if set to a list, parser appends [offset of "---" line,
+    # offsets of "@@" lines, end offset] for every patch
+    self.offsets = None
+    self._trailer = []
     if stream:
       self.parse(stream)
     if debugmode:
@@ -55,6 +96,16 @@ class PatchSet(object):
   def __len__(self):
     return len(self.items)
 
+  def __getstate__(self):
+    # loggers hold streams and locks, which can't be pickled
+    state = self.__dict__.copy()
+    del state["logger"]
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.logger = default_logger
+
   def __iter__(self):
     for i in self.items:
       yield i
@@ -63,13 +114,49 @@ class PatchSet(object):
     """ parse unified diff
         return True on success
     """
+    parsed = 0
+    for p in self.iterparse(stream):
+      self.items.append(p)
+      parsed += 1
+
+    if parsed == 0:
+      # all files filtered out by include/exclude is not a failure
+      return bool(self.skipped) and self.errors == 0
+
+    # XXX fix total hunks calculation
+    self.logger.debug("total files: %d  total hunks: %d" % (len(self.items),
+        sum(len(p.hunks) for p in self.items)))
+
+    return (self.errors == 0)
+
+  def iterparse(self, stream):
+    """ parse unified diff and yield Patch objects one by one
+        as soon as they are complete, i.e. with detected type
+        and normalized filenames. Parsed patches are not stored
+        in self.items, so memory is bounded by the largest patch.
+
+        self.type, self.errors and self.warnings are updated
+        while patches are yielded.
+    """
+    return self._iterparse(stream)
+
+  def _iterparse(self, stream, finalize=True):
+    """ iterparse() implementation, if `finalize` is False raw
+        patches are yielded without type detection and filename
+        normalization
+    """
     lineends = dict(lf=0, crlf=0, cr=0)
     nexthunkno = 0    #: even if index starts with 0 user messages number hunks from 1
 
     p = None
     hunk = None
+    hunklines = None
     # hunkactual variable is used to calculate hunk lines for comparison
-    hunkactual = dict(linessrc=None, linestgt=None)
+    # and to gather line stats
+    hunkactual = dict(linessrc=None, linestgt=None,
+                      inserts=None, deletes=None, delta=None)
+    bodystart = None  #: byte offset of current hunk body
+    srcoffset = None  #: byte offset of current source filename line
 
 
     class wrapumerate(enumerate):
@@ -81,8 +168,13 @@ class PatchSet(object):
         # we don't call parent, it is magically created by __new__ method
 
         self._exhausted = False
+        self._waiting = False    # push stream has no complete line yet
+        self._overflow = False   # next line exceeds max_bytes limit
         self._lineno = False     # after end of stream equal to the num of lines
         self._line = False       # will be reset to False after end of stream
+        self._skipped = 0        # lines consumed bypassing the iterator
+        self._offset = 0         # byte offset of the current line
+        self._pos = 0            # byte offset of the next line
 
       def next(self):
         """Try to read the next line and return True if it is available,
@@ -90,25 +182,59 @@ class PatchSet(object):
         if self._exhausted:
           return False
 
+        self._waiting = False
         try:
           self._lineno, self._line = compat_next(super(wrapumerate, self))
         except StopIteration:
           self._exhausted = True
           self._line = False
           return False
+        except buffers.NeedMore:
+          self._waiting = True
+          return False
+        except buffers.LimitExceeded:
+          self._exhausted = True
+          self._overflow = True
+          self._line = False
+          return False
+        self._offset = self._pos
+        self._pos += len(self._line)
         return True
 
       @property
       def is_empty(self):
         return self._exhausted
 
+      @property
+      def waiting(self):
+        return self._waiting
+
+      @property
+      def overflow(self):
+        return self._overflow
+
+      @property
+      def pos(self):
+        """byte offset of the next line"""
+        return self._pos
+
       @property
       def line(self):
         return self._line
 
       @property
       def lineno(self):
-        return self._lineno
+        return self._lineno + self._skipped
+
+      @property
+      def offset(self):
+        return self._offset
+
+      def skip(self, n, pos):
+        """Account for `n` lines consumed directly from the stream,
+           which is now positioned at byte offset `pos`."""
+        self._skipped += n
+        self._pos = pos
 
     # define states (possible file regions) that direct parse flow
     headscan  = True  # start with scanning header
@@ -119,20 +245,72 @@ class PatchSet(object):
     hunkskip = False  # skipping invalid hunk mode
 
     hunkparsed = False # state after successfully parsed hunk
+    fileskip = False   # skipping hunks of file filtered out
 
-    # regexp to match start of hunk, used groups - 1,3,4,6
-    re_hunk_start = re.compile(b"^@@ -(\d+)(,(\d+))? \+(\d+)(,(\d+))? @@")
     
     self.errors = 0
+    self.skipped = 0
+    self.limited = None
+    self.type = None
+    self._trailer = []  #: unparsed lines left at the end of stream
+    count = 0    #: number of yielded patches
     # temp buffers for header and filenames info
     header = []
     srcname = None
+    srcline = None
     tgtname = None
+    include = pathutil.patterns(self.include)
+    exclude = pathutil.patterns(self.exclude)
+    filtered = include is not None or bool(exclude)
+    skipsrc = skiptgt = 0  #: lines left in skipped hunk
+    limits = self.limits
+    hunkcount = 0   #: hunks parsed, checked against limits
 
     # start of main cycle
     # each parsing block already has line available in fe.line
-    fe = wrapumerate(stream)
-    while fe.next():
+    # buffer backed streams allow to scan hunks without copying lines
+    reader = stream if isinstance(stream, buffers.BufferReader) else None
+    start = buffers.stream_offset(stream)
+    lines = stream
+    bytelimit = deadline = None
+    if limits is not None:
+      if limits.max_bytes is not None:
+        bytelimit = start + limits.max_bytes
+        if reader is None and hasattr(stream, "readline"):
+          # don't read lines longer than the limit in full
+          lines = buffers.LimitedReader(stream, limits.max_bytes)
+      if limits.max_time is not None:
+        deadline = time.time() + limits.max_time
+    fe = wrapumerate(lines)
+    fe.skip(0, start)
+
+    def exceeded():
+      """ return name of exceeded byte or time limit or None,
+          checked wherever lines are read
+      """
+      if bytelimit is not None and fe.pos > bytelimit:
+        return "max_bytes"
+      if deadline is not None and time.time() > deadline:
+        return "max_time"
+      return None
+    # in lazy mode hunk bodies are not stored, but read from source
+    source = None
+    if self.lazy:
+      source = buffers.source_for(stream)
+      if source is None:
+        self.logger.debug("stream is not seekable - hunk bodies are loaded")
+    while True:
+      if not fe.next():
+        if fe.waiting:
+          # push stream (see PushParser) - wait until more data is fed
+          yield NEED_MORE
+          continue
+        break
+
+      if limits is not None:
+        self.limited = exceeded()
+        if self.limited:
+          break
 
       # -- deciders: these only switch state to decide who should process
       # --           line fetched at the start of this cycle
@@ -146,18 +324,62 @@ class PatchSet(object):
             headscan = True
       # -- ------------------------------------
 
+      # hunks of filtered out files are only counted
+      if fileskip:
+        line = fe.line
+        c = line[:1]
+        if skipsrc or skiptgt:
+          if line.strip(b"\r\n") == b"":
+            c = b" "
+          if c == b" " and skipsrc and skiptgt:
+            skipsrc -= 1
+            skiptgt -= 1
+            continue
+          elif c == b"-" and skipsrc:
+            skipsrc -= 1
+            continue
+          elif c == b"+" and skiptgt:
+            skiptgt -= 1
+            continue
+          elif c == b"\\":
+            continue
+          self.logger.warning("invalid hunk at %d for skipped file" % (fe.lineno+1))
+          self.errors += 1
+          skipsrc = skiptgt = 0
+        elif c == b"\\":
+          continue
+        match = re_hunk_start.match(line)
+        if match:
+          skipsrc = int(match.group(3)) if match.group(3) else 1
+          skiptgt = int(match.group(6)) if match.group(6) else 1
+          continue
+        fileskip = False
+        headscan = True
+
       # read out header
       if headscan:
         while not fe.is_empty and not fe.line.startswith(b"--- "):
             header.append(fe.line)
-            fe.next()
+            if limits is not None:
+              if limits.max_header_lines is not None \
+                 and len(header) > limits.max_header_lines:
+                self.limited = "max_header_lines"
+              else:
+                self.limited = exceeded()
+              if self.limited:
+                break
+            while not fe.next() and fe.waiting:
+              yield NEED_MORE
+        if self.limited or fe.overflow:
+          break
         if fe.is_empty:
-            if p == None:
+            if p == None and not self.skipped:
               self.logger.debug("no patch data found")  # error is shown later
               self.errors += 1
-            else:
+            elif p != None or header:
               self.logger.info("%d unparsed bytes left at the end of stream" % len(b''.join(header)))
               self.warnings += 1
+              self._trailer = header
               # TODO check for \No new line at the end.. 
               # TODO test for unparsed bytes
               # otherwise error += 1
@@ -174,48 +396,133 @@ class PatchSet(object):
 
       # hunkskip and hunkbody code skipped until definition of hunkhead is parsed
       if hunkbody:
-        # [x] treat empty lines inside hunks as containing single space
-        #     (this happens when diff is saved by copy/pasting to editor
-        #      that strips trailing whitespace)
-        if line.strip(b"\r\n") == b"":
-            self.logger.debug("expanding empty line in a middle of hunk body")
-            self.warnings += 1
-            line = b' ' + line
-
-        # process line first
-        if re.match(b"^[- \\+\\\\]", line):
-            # gather stats about line endings
-            if line.endswith(b"\r\n"):
-              p.hunkends["crlf"] += 1
-            elif line.endswith(b"\n"):
-              p.hunkends["lf"] += 1
-            elif line.endswith(b"\r"):
-              p.hunkends["cr"] += 1
-              
-            if line.startswith(b"-"):
-              hunkactual["linessrc"] += 1
-            elif line.startswith(b"+"):
-              hunkactual["linestgt"] += 1
-            elif not line.startswith(b"\\"):
-              hunkactual["linessrc"] += 1
-              hunkactual["linestgt"] += 1
-            hunk.text.append(line)
-            # todo: handle \ No newline cases
+        if self.fastpath:
+          # fast path: @@ header already tells how many lines to expect,
+          # so consume them in a tight loop and leave anything unusual
+          # (empty lines, invalid or extra lines) to the generic code
+          ends = p.hunkends
+          consumed = True   # False if line is left for the generic code
+          if reader is not None and source is None and not hunklines:
+            consumed, hunklines = self._scan_buffer(reader, fe, hunk,
+                                                    ends, hunkactual, bytelimit)
+            line = fe.line
+          else:
+            srcleft = hunk.linessrc - hunkactual["linessrc"]
+            tgtleft = hunk.linestgt - hunkactual["linestgt"]
+            inserts = hunkactual["inserts"]
+            deletes = hunkactual["deletes"]
+            delta = hunkactual["delta"]
+            append = hunklines.append
+            while True:
+              c = line[:1]
+              if c == b" " and srcleft and tgtleft:
+                srcleft -= 1
+                tgtleft -= 1
+              elif c == b"-" and srcleft:
+                srcleft -= 1
+                deletes += 1
+                delta -= len(line) - 1
+              elif c == b"+" and tgtleft:
+                tgtleft -= 1
+                inserts += 1
+                delta += len(line) - 1
+              elif c != b"\\":
+                consumed = False
+                break
+              if line.endswith(b"\r\n"):
+                ends["crlf"] += 1
+              elif line.endswith(b"\n"):
+                ends["lf"] += 1
+              elif line.endswith(b"\r"):
+                ends["cr"] += 1
+              if source is None:
+                append(line)
+              if not srcleft and not tgtleft:
+                break
+              if limits is not None:
+                self.limited = exceeded()
+                if self.limited:
+                  break
+              if not fe.next():
+                break
+              line = fe.line
+            hunkactual["linessrc"] = hunk.linessrc - srcleft
+            hunkactual["linestgt"] = hunk.linestgt - tgtleft
+            hunkactual["inserts"] = inserts
+            hunkactual["deletes"] = deletes
+            hunkactual["delta"] = delta
+            if self.limited:
+              break
+          lineno = fe.lineno
+          if consumed and (hunkactual["linessrc"] < hunk.linessrc
+                           or hunkactual["linestgt"] < hunk.linestgt):
+            # end of stream in the middle of hunk
+            continue
         else:
-            self.logger.warning("invalid hunk no.%d at %d for target file %s" % (nexthunkno, lineno+1, p.target))
-            # add hunk status node
-            hunk.invalid = True
-            p.hunks.append(hunk)
-            self.errors += 1
-            # switch to hunkskip state
-            hunkbody = False
-            hunkskip = True
+          consumed = False
+
+        if not consumed:
+          # [x] treat empty lines inside hunks as containing single space
+          #     (this happens when diff is saved by copy/pasting to editor
+          #      that strips trailing whitespace)
+          if line.strip(b"\r\n") == b"":
+              self.logger.debug("expanding empty line in a middle of hunk body")
+              self.warnings += 1
+              line = b' ' + line
+
+          # process line first
+          if re_hunk_line.match(line):
+              # gather stats about line endings
+              if line.endswith(b"\r\n"):
+                p.hunkends["crlf"] += 1
+              elif line.endswith(b"\n"):
+                p.hunkends["lf"] += 1
+              elif line.endswith(b"\r"):
+                p.hunkends["cr"] += 1
+              
+              if line.startswith(b"-"):
+                hunkactual["linessrc"] += 1
+                hunkactual["deletes"] += 1
+                hunkactual["delta"] -= len(line) - 1
+              elif line.startswith(b"+"):
+                hunkactual["linestgt"] += 1
+                hunkactual["inserts"] += 1
+                hunkactual["delta"] += len(line) - 1
+              elif not line.startswith(b"\\"):
+                hunkactual["linessrc"] += 1
+                hunkactual["linestgt"] += 1
+              if source is None:
+                hunklines.append(line)
+              # todo: handle \ No newline cases
+          else:
+              self.logger.warning("invalid hunk no.%d at %d for target file %s" % (nexthunkno, lineno+1, p.target))
+              # add hunk status node
+              hunk.invalid = True
+              self._close_hunk(hunk, hunklines, hunkactual,
+                               source, bodystart, fe.offset)
+              p.hunks.append(hunk)
+              self.errors += 1
+              # switch to hunkskip state
+              hunkbody = False
+              hunkskip = True
 
         # check exit conditions
         if hunkactual["linessrc"] > hunk.linessrc or hunkactual["linestgt"] > hunk.linestgt:
             self.logger.warning("extra lines for hunk no.%d at %d for target %s" % (nexthunkno, lineno+1, p.target))
             # add hunk status node
             hunk.invalid = True
+            end = fe.pos
+            if line.startswith(b"--- "):
+              # this line starts next file diff and is processed
+              # again in hunkskip state, so it is not hunk line
+              end = fe.offset
+              if source is None:
+                hunklines.pop()
+              hunkactual["linessrc"] -= 1
+              hunkactual["deletes"] -= 1
+              hunkactual["delta"] += len(line) - 1
+            self._close_hunk(hunk, hunklines, hunkactual,
+                             source, bodystart, end)
             p.hunks.append(hunk)
             self.errors += 1
             # switch to hunkskip state
@@ -223,6 +530,8 @@ class PatchSet(object):
             hunkskip = True
         elif hunk.linessrc == hunkactual["linessrc"] and hunk.linestgt == hunkactual["linestgt"]:
             # hunk parsed successfully
+            self._close_hunk(hunk, hunklines, hunkactual,
+                             source, bodystart, fe.pos)
             p.hunks.append(hunk)
             # switch to hunkparsed state
             hunkbody = False
@@ -249,8 +558,11 @@ class PatchSet(object):
           # switch to filenames state
           hunkskip = False
           filenames = True
-          if self.debugmode and len(self.items) > 0:
+          if self.debugmode and p:
             self.logger.debug("- %2d hunks for %s" % (len(p.hunks), p.source))
+        elif self.offsets is not None:
+          # lines of invalid hunk are skipped as part of the patch
+          self.offsets[-1][2] = fe.pos
 
       if filenames:
         if line.startswith(b"--- "):
@@ -261,11 +573,12 @@ class PatchSet(object):
             # XXX header += srcname
             # double source filename line is encountered
             # attempt to restart from this second line
-          re_filename = b"^--- ([^\t]+)"
-          match = re.match(re_filename, line)
+          match = re_source.match(line)
           # TODO: support spaces in filenames
           if match:
             srcname = match.group(1).strip()
+            srcline = line
+            srcoffset = fe.offset
           else:
             self.logger.warning("skipping invalid filename at line %d" % (lineno+1))
             self.errors += 1
@@ -300,8 +613,7 @@ class PatchSet(object):
             filenames = False
             headscan = True
           else:
-            re_filename = b"^\+\+\+ ([^\t]+)"
-            match = re.match(re_filename, line)
+            match = re_target.match(line)
             if not match:
               self.logger.warning("skipping invalid patch - no target filename at line %d" % (lineno+1))
               self.errors += 1
@@ -309,13 +621,34 @@ class PatchSet(object):
               # switch back to headscan state
               filenames = False
               headscan = True
+            elif limits is not None and limits.max_files is not None \
+                 and count + (p is not None) + self.skipped >= limits.max_files:
+              self.limited = "max_files"
+              if p:
+                # previous patch is complete
+                yield self._finalize(p, count) if finalize else p
+                count += 1
+                p = None
+              break
+            elif filtered and not pathutil.match_filenames(srcname,
+                    match.group(1).strip(), include, exclude):
+              self.logger.debug("skipping filtered out file %s" % srcname)
+              self.skipped += 1
+              srcname = None
+              header = []
+              # switch to fileskip state
+              filenames = False
+              fileskip = True
+              continue
             else:
               if p: # for the first run p is None
-                self.items.append(p)
+                yield self._finalize(p, count) if finalize else p
+                count += 1
               p = dataobjects.Patch()
               p.source = srcname
               srcname = None
               p.target = match.group(1).strip()
+              p.rawnames = (srcline, line)
               p.header = header
               header = []
               # switch to hunkhead state
@@ -323,10 +656,12 @@ class PatchSet(object):
               hunkhead = True
               nexthunkno = 0
               p.hunkends = lineends.copy()
+              if self.offsets is not None:
+                self.offsets.append([srcoffset, [], None])
               continue
 
       if hunkhead:
-        match = re.match(b"^@@ -(\d+)(,(\d+))? \+(\d+)(,(\d+))? @@(.*)", line)
+        match = re_hunk_head.match(line)
         if not match:
           if not p.hunks:
             self.logger.warning("skipping invalid patch with no hunks for file %s" % p.source)
@@ -351,9 +686,25 @@ class PatchSet(object):
           if match.group(6): hunk.linestgt = int(match.group(6))
           hunk.invalid = False
           hunk.desc = match.group(7)[1:].rstrip()
-          hunk.text = []
+          hunk.rawhead = line
+          if limits is not None:
+            if limits.max_hunks is not None and hunkcount >= limits.max_hunks:
+              self.limited = "max_hunks"
+              break
+            if limits.max_hunk_lines is not None and \
+               hunk.linessrc + hunk.linestgt > limits.max_hunk_lines:
+              self.limited = "max_hunk_lines"
+              break
+          hunkcount += 1
+          # hunk lines are collected here and packed into
+          # hunk.text when the hunk is over
+          hunklines = self._new_lines()
 
           hunkactual["linessrc"] = hunkactual["linestgt"] = 0
+          hunkactual["inserts"] = hunkactual["deletes"] = hunkactual["delta"] = 0
+          bodystart = fe.offset + len(line)
+          if self.offsets is not None:
+            self.offsets[-1][1].append(fe.offset)
 
           # switch to hunkbody state
           hunkhead = False
@@ -361,49 +712,254 @@ class PatchSet(object):
           nexthunkno += 1
           continue
 
-    # /while fe.next()
-
-    if p:
-      self.items.append(p)
-
-    if not hunkparsed:
+    # /while True
+
+    if fe.overflow:
+      # the line that didn't fit into the limit was not read
+      self.limited = "max_bytes"
+    if self.limited:
+      # patch that was being parsed is incomplete and dropped
+      self.logger.warning("error: parsing stopped, %s limit of %s exceeded"
+                          % (self.limited, getattr(limits, self.limited)))
+      self.errors += 1
+      p = None
+    elif not hunkparsed:
       if hunkskip:
         self.logger.warning("warning: finished with errors, some hunks may be invalid")
+      elif fileskip and not (skipsrc or skiptgt):
+        pass
       elif headscan:
-        if len(self.items) == 0:
+        if p is None and not self.skipped:
           self.logger.warning("error: no patch data found!")
-          return False
         else: # extra data at the end of file
           pass 
       else:
         self.logger.warning("error: patch stream is incomplete!")
         self.errors += 1
-        if len(self.items) == 0:
-          return False
 
-    if self.debugmode and len(self.items) > 0:
+    if p:
+      if self.debugmode:
         self.logger.debug("- %2d hunks for %s" % (len(p.hunks), p.source))
+      yield self._finalize(p, count) if finalize else p
+
+  @classmethod
+  def open_indexed(cls, filename, lg=default_logger, debugmode=False):
+    """ return utils.index.PatchIndex for patch file, which
+        parses diffs of selected files only. Offsets index is
+        kept next to the patch in a .patchidx file, it is
+        built (full parse) when missing or out of date.
+    """
+    from . import index
+    return index.open_index(filename, lg, debugmode)
+
+  def parse_file(self, filename, mmap=False, workers=None):
+    """ parse unified diff file, see patcher.fromfile() for
+        description of `mmap` and `workers`. Compressed files
+        are decompressed while parsing.
+
+        return True on success
+    """
+    fp = open(filename, "rb")
+    try:
+      stream, compression = compress.open_stream(fp)
+      if compression:
+        # decompressed stream can only be read sequentially
+        self.logger.debug("decompressing %s input" % compression)
+        self.lazy = False
+        return self.parse(stream)
+      # workers parse chunks without filters and limits
+      restricted = self.include is not None or self.exclude or self.limits
+      if workers and workers > 1 and not (mmap or self.lazy or self.spillsize
+                                          or restricted):
+        return self.parse_parallel(filename, workers)
+      stream = None
+      if mmap:
+        stream = buffers.mapfile(fp)
+      return self.parse(stream or fp)
+    finally:
+      fp.close()
+
+  def parse_parallel(self, filename, workers):
+    """ parse unified diff file in a pool of `workers` processes.
+        The file is split into chunks at lines starting new file
+        diff, which are parsed separately and merged back. Result
+        is the same as of parse(). Falls back to parse() if the
+        file can not be split or chunks have parsing errors.
+
+        return True on success
+    """
+    bounds = _split_points(filename, workers * 4)
+    if len(bounds) > 2:
+      import concurrent.futures
+      chunks = [(filename, bounds[i], bounds[i+1]) for i in range(len(bounds)-1)]
+      with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_parse_chunk, chunks))
+      # errors may depend on neighbouring chunks
+      if all(errors == 0 and items for items, errors, warnings, trailer in results):
+        return self._merge_chunks(results)
+      self.logger.debug("parallel parse failed, parsing %s again" % filename)
+
+    fp = open(filename, "rb")
+    try:
+      return self.parse(fp)
+    finally:
+      fp.close()
+
+  def _merge_chunks(self, results):
+    """ merge raw patches parsed from consecutive chunks, see
+        parse_parallel()
+    """
+    self.errors = 0
+    self.type = None
+    trailer = []
+    for items, errors, warnings, chunktrailer in results:
+      if trailer:
+        # unparsed lines at the end of previous chunk are the start
+        # of next patch header, which is not a warning in this case
+        items[0].header[0:0] = trailer
+        self.warnings -= 1
+      for p in items:
+        self.items.append(self._finalize(p, len(self.items)))
+      self.errors += errors
+      self.warnings += warnings
+      trailer = chunktrailer
+    self._trailer = trailer
 
-    # XXX fix total hunks calculation
     self.logger.debug("total files: %d  total hunks: %d" % (len(self.items),
         sum(len(p.hunks) for p in self.items)))
+    return (self.errors == 0)
 
-    # ---- detect patch and patchset types ----
-    for idx, p in enumerate(self.items):
-      self.items[idx].type = self._detect_type(p)
+  def _finalize(self, p, idx):
+    """ detect type and normalize filenames of a freshly parsed
+        Patch, updating PatchSet type and error counters
 
-    types = set([p.type for p in self.items])
-    if len(types) > 1:
+        return the same Patch object
+    """
+    p.type = self._detect_type(p)
+    if self.type is None:
+      self.type = p.type
+    elif self.type != p.type:
       self.type = variables.MIXED
-    else:
-      self.type = types.pop()
-    # --------
 
-    _e, _w, self.items = pathutil.normalize_filenames(self.items, self.logger, debugmode=self.debugmode)
+    _e, _w = pathutil.normalize_patch(p, idx, self.logger, debugmode=self.debugmode)
     self.errors += _e
     self.warnings += _w
-    
-    return (self.errors == 0)
+    return p
+
+  def _new_lines(self):
+    """ return empty list to collect hunk lines, which spills
+        to disk if spillsize is set
+    """
+    if self.statsonly:
+      return buffers.NullLines()
+    if self.spillsize:
+      return buffers.SpooledLines(self.spillsize)
+    return []
+
+  def _close_hunk(self, hunk, lines, actual, source, start, end):
+    """ set text and line stats of a hunk that is over, in lazy
+        mode text is read later from `source` between offsets
+    """
+    rawhead = hunk.rawhead
+    if self.statsonly:
+      hunk.text = []
+    elif source is None:
+      hunk.text = lines
+    else:
+      hunk.text = source.lines(start, end)
+    hunk.rawhead = rawhead
+    if self.offsets is not None:
+      self.offsets[-1][2] = end
+    hunk.inserts = actual["inserts"]
+    hunk.deletes = actual["deletes"]
+    hunk.delta = actual["delta"]
+
+  def _scan_buffer(self, reader, fe, hunk, ends, actual, limit=None):
+    """ zero-copy variant of hunk body fast path for BufferReader
+        streams. Hunk lines starting from the current one are
+        scanned in place and returned as LineView over the buffer.
+        If some line needs the generic code, lines scanned so far
+        are returned as a list and the reader is positioned at
+        that line. Line counters in `actual` are updated. Scan
+        stops after the line that crosses `limit` offset, as if
+        the buffer ended there.
+
+        return (consumed, lines)
+    """
+    srcleft = hunk.linessrc - actual["linessrc"]
+    tgtleft = hunk.linestgt - actual["linestgt"]
+    inserts = deletes = delta = 0
+    buf = reader.buffer
+    size = len(buf)
+    stop = size if limit is None else min(size, limit + 1)
+    find = buf.find
+    pos = reader.tell() - len(fe.line)
+    offsets = buffers.offsets_array(size)
+    consumed = True
+    scanned = None
+    if accel.numpy is not None and srcleft + tgtleft >= accel.MIN_LINES \
+       and stop == size:
+      scanned = accel.scan_hunk(buf, pos, srcleft, tgtleft)
+    if scanned is not None:
+      (starts, pos, srcleft, tgtleft, inserts, deletes, delta,
+       crlf, lf, cr, consumed) = scanned
+      offsets.frombytes(starts.astype(offsets.typecode).tobytes())
+      ends["crlf"] += crlf
+      ends["lf"] += lf
+      ends["cr"] += cr
+    while scanned is None:
+      c = buf[pos]
+      if c == 32 and srcleft and tgtleft:  # b" "
+        srcleft -= 1
+        tgtleft -= 1
+      elif c == 45 and srcleft:            # b"-"
+        srcleft -= 1
+        deletes += 1
+      elif c == 43 and tgtleft:            # b"+"
+        tgtleft -= 1
+        inserts += 1
+      elif c != 92:                        # b"\\"
+        consumed = False
+        break
+      eol = find(b"\n", pos)
+      if eol < 0:
+        end = size
+        if buf[end-1] == 13:
+          ends["cr"] += 1
+      else:
+        end = eol + 1
+        if eol > pos and buf[eol-1] == 13:
+          ends["crlf"] += 1
+        else:
+          ends["lf"] += 1
+      if c == 43:
+        delta += end - pos - 1
+      elif c == 45:
+        delta -= end - pos - 1
+      offsets.append(pos)
+      pos = end
+      if (not srcleft and not tgtleft) or pos >= stop:
+        break
+
+    actual["linessrc"] = hunk.linessrc - srcleft
+    actual["linestgt"] = hunk.linestgt - tgtleft
+    actual["inserts"] += inserts
+    actual["deletes"] += deletes
+    actual["delta"] += delta
+
+    scanned = len(offsets)
+    offsets.append(pos)
+    lines = buffers.LineView(buf, offsets)
+    if consumed:
+      reader.seek(pos)
+      fe.skip(scanned - 1, pos)
+    else:
+      lines = list(lines)
+      if scanned:
+        reader.seek(pos)
+        fe.skip(scanned - 1, pos)
+        fe.next()
+    return consumed, lines
 
   def _detect_type(self, p):
     """ detect and return type for the specified Patch object
@@ -466,62 +1022,26 @@ class PatchSet(object):
 
     return variables.PLAIN
 
+  def stats(self):
+    """ return list of (target, insertions, deletions, size
+        change in bytes) tuples, one for every patch
+    """
+    return [(p.target,) + p.stats() for p in self.items]
+
   def diffstat(self):
     """ calculate diffstat and return as a string
         Notes:
           - original diffstat ouputs target filename
           - single + or - shouldn't escape histogram
     """
-    names = []
-    insert = []
-    delete = []
-    delta = 0    # size change in bytes
-    namelen = 0
-    maxdiff = 0  # max number of changes for single file
-                 # (for histogram width calculation)
-    for patch in self.items:
-      i,d = 0,0
-      for hunk in patch.hunks:
-        for line in hunk.text:
-          if line.startswith(b'+'):
-            i += 1
-            delta += len(line)-1
-          elif line.startswith(b'-'):
-            d += 1
-            delta -= len(line)-1
-      names.append(patch.target)
-      insert.append(i)
-      delete.append(d)
-      namelen = max(namelen, len(patch.target))
-      maxdiff = max(maxdiff, i+d)
-    output = ''
-    statlen = len(str(maxdiff))  # stats column width
-    for i,n in enumerate(names):
-      # %-19s | %-4d %s
-      format = " %-" + str(namelen) + "s | %" + str(statlen) + "s %s\n"
-
-      hist = ''
-      # -- calculating histogram --
-      width = len(format % ('', '', ''))
-      histwidth = max(2, 80 - width)
-      if maxdiff < histwidth:
-        hist = "+"*insert[i] + "-"*delete[i]
-      else:
-        iratio = (float(insert[i]) / maxdiff) * histwidth
-        dratio = (float(delete[i]) / maxdiff) * histwidth
-
-        # make sure every entry gets at least one + or -
-        iwidth = 1 if 0 < iratio < 1 else int(iratio)
-        dwidth = 1 if 0 < dratio < 1 else int(dratio)
-        #print(iratio, dratio, iwidth, dwidth, histwidth)
-        hist = "+"*int(iwidth) + "-"*int(dwidth)
-      # -- /calculating +- histogram --
-      output += (format % (tostr(names[i]), str(insert[i] + delete[i]), hist))
- 
-    output += (" %d files changed, %d insertions(+), %d deletions(-), %+d bytes"
-               % (len(names), sum(insert), sum(delete), delta))
-    return output
-  
+    return format_diffstat(self.stats())
+
+  def numstat(self):
+    """ return insertions, deletions and target of every patch
+        as tab separated lines, like git diff --numstat
+    """
+    return format_numstat(self.stats())
+
   def findfile(self, old, new):
     """ return name of file to be patched or None """
     old_null = old.startswith(b'/dev/null')
@@ -597,23 +1117,16 @@ class PatchSet(object):
       self.logger.debug("processing %d/%d:\t %s" % (i+1, total, filename))
 
       # Write to output file, if source/target is /dev/null (it's not present)
-      remmaped = [] 
-      is_negative = False
       if not isfile(filename):
-        for x in range(len(p.hunks)):
-          curh = p.hunks[x]
-          if is_negative:
-            break
-          for y in range(len(curh.text)):
-            if curh.text[y].decode('utf-8').startswith("-"):
-              is_negative = True
-              break
-            remmaped.append(curh.text[y].decode('utf-8')[1:] if len(curh.text[y].decode('utf-8')) > 1 else "")
-        to_write = "".join(remmaped).replace("\r\n", "\n")
+        is_negative = any(line.startswith(b"-") for h in p.hunks for line in h.text)
         if is_negative:
           continue
+        # hunks are written line by line, so that spilled ones
+        # are not loaded into memory
         fw = open(pathlib.Path(filename.decode('utf-8')), 'w', encoding='utf-8')
-        fw.write(to_write)
+        for h in p.hunks:
+          for line in h.text:
+            fw.write(line.decode('utf-8')[1:].replace("\r\n", "\n"))
         fw.close()
         self.logger.debug("Successfully created unpatchable file!")
         continue
@@ -621,29 +1134,31 @@ class PatchSet(object):
       hunkno = 0
       hunk = p.hunks[hunkno]
       f2fp = open(filename, 'rb')
-      hunkfind = []
-      hunkreplace = []
+      hunkfind = iter([])   # source lines expected by hunk
+      hunkfindlen = 0
       validhunks = 0
       canpatch = False
       for lineno, line in enumerate(f2fp):
         if lineno+1 < hunk.startsrc:
           continue
         elif lineno+1 == hunk.startsrc:
-          hunkfind = [x[1:].rstrip(b"\r\n") for x in hunk.text if x[0] in b" -"]
-          hunkreplace = [x[1:].rstrip(b"\r\n") for x in hunk.text if x[0] in b" +"]
-          #pprint(hunkreplace)
+          # hunk lines are read as they are checked, so big
+          # (spilled) hunks are not loaded into memory
+          hunkfind = (x[1:].rstrip(b"\r\n") for x in hunk.text if x[0] in b" -")
+          hunkfindlen = sum(1 for x in hunk.text if x[0] in b" -")
           hunklineno = 0
 
           # todo \ No newline at end of file
 
         # check hunks in source file
-        if lineno+1 < hunk.startsrc+len(hunkfind)-1:
-          if line.rstrip(b"\r\n") == hunkfind[hunklineno]:
+        if lineno+1 < hunk.startsrc+hunkfindlen-1:
+          expected = next(hunkfind)
+          if line.rstrip(b"\r\n") == expected:
             hunklineno+=1
           else:
             self.logger.info("file %d/%d:\t %s" % (i+1, total, filename))
             self.logger.info(" hunk no.%d doesn't match source file at line %d" % (hunkno+1, lineno+1))
-            self.logger.info("  expected: %s" % hunkfind[hunklineno])
+            self.logger.info("  expected: %s" % expected)
             self.logger.info("  actual  : %s" % line.rstrip(b"\r\n"))
             # not counting this as error, because file may already be patched.
             # check if file is already patched is done after the number of
@@ -661,7 +1176,7 @@ class PatchSet(object):
               break
 
         # check if processed line is the last line
-        if lineno+1 == hunk.startsrc+len(hunkfind)-1:
+        if lineno+1 == hunk.startsrc+hunkfindlen-1:
           self.logger.debug(" hunk no.%d for file %s  -- is ready to be patched" % (hunkno+1, filename))
           hunkno+=1
           validhunks+=1
@@ -716,17 +1231,21 @@ class PatchSet(object):
       for h in p.hunks:
         h.startsrc, h.starttgt = h.starttgt, h.startsrc
         h.linessrc, h.linestgt = h.linestgt, h.linessrc
-        for i,line in enumerate(h.text):
+        text = self._new_lines()
+        for line in h.text:
           # need to use line[0:1] here, because line[0]
           # returns int instead of bytes on Python 3
           if line[0:1] == b'+':
-            h.text[i] = b'-' + line[1:]
+            line = b'-' + line[1:]
           elif line[0:1] == b'-':
-            h.text[i] = b'+' +line[1:]
+            line = b'+' + line[1:]
+          text.append(line)
+        h.text = text
 
   def revert(self, strip=0, root=None):
     """ apply patch in reverse order """
     reverted = copy.deepcopy(self)
+    reverted.logger = self.logger
     reverted._reverse()
     return reverted.apply(strip, root)
 
@@ -860,18 +1379,367 @@ class PatchSet(object):
     return True
 
 
-  def dump(self):
+  def save(self, filename):
+    """ save parsed patches into compact binary container,
+        which is loaded back with patcher.fromcontainer()
+    """
+    container.save(self, filename)
+
+  def compress_hunks(self, method="zlib"):
+    """ keep hunk lines of every patch compressed in memory,
+        `method` is "zlib" or "lzma". Lines are decompressed
+        on access and those of recently used patches are kept
+        in buffers.blob_cache.
+
+        return (size of lines, compressed size) in bytes
+    """
+    total = compressed = 0
     for p in self.items:
-      for headline in p.header:
-        print(headline.rstrip('\n'))
-      print('--- ' + p.source)
-      print('+++ ' + p.target)
-      for h in p.hunks:
-        print('@@ -%s,%s +%s,%s @@' % (h.startsrc, h.linessrc, h.starttgt, h.linestgt))
-        for line in h.text:
-          print(line.rstrip('\n'))
+      blob = buffers.compress_hunks(p.hunks, method)
+      total += blob.size
+      compressed += len(blob)
+    return total, compressed
+
 
+  def _lines(self):
+    """ yield lines (or joined hunk bodies) of all patches in
+        unified diff format
+    """
+    for p in self.items:
+      for line in patch_lines(p, joined=True):
+        yield line
+    for line in self._trailer:
+      yield line
+
+  def write(self, stream, bufsize=2**20):
+    """ write patches as unified diff into binary stream. Lines
+        are joined into blocks of about `bufsize` bytes, each
+        written with one call. Parsed patch is written back the
+        same as it was, except that empty lines in hunks get
+        the space they had lost.
+    """
+    block = []
+    size = 0
+    for line in self._lines():
+      block.append(line)
+      size += len(line)
+      if size >= bufsize:
+        stream.write(b"".join(block))
+        block = []
+        size = 0
+    if block:
+      stream.write(b"".join(block))
+
+  def to_bytes(self):
+    """ return patches as unified diff bytes, see write() """
+    return b"".join(self._lines())
 
+  def dump(self):
+    """ print patches to stdout """
+    sys.stdout.flush()
+    self.write(sys.stdout.buffer)
+    sys.stdout.buffer.flush()
+
+
+class PushParser(object):
+  """ Incremental parser for data that arrives in chunks, e.g.
+      from a socket. Chunks are passed to feed(), which returns
+      patches completed so far (and calls `callback` for each
+      of them). close() finishes parsing and returns the rest.
+      Parsed patches are collected in `patchset` unless `keep`
+      is False. Lines may be split between chunks.
+
+        parser = PushParser()
+        async for chunk in body:
+          for p in parser.feed(chunk):
+            ...
+        parser.close()
+  """
+
+  def __init__(self, patchset=None, callback=None, keep=True):
+    self.patchset = patchset if patchset is not None else PatchSet()
+    self.callback = callback
+    self.keep = keep
+    self._reader = buffers.PushReader()
+    self._parser = self.patchset._iterparse(self._reader)
+
+  def feed(self, data):
+    """ parse chunk of bytes, return list of completed patches """
+    self._reader.feed(data)
+    return self._run()
+
+  def close(self):
+    """ finish parsing, return list of remaining patches.
+        Check `patchset.errors` to see if parsing succeeded.
+    """
+    self._reader.close()
+    return self._run()
+
+  def _run(self):
+    done = []
+    for p in self._parser:
+      if p is NEED_MORE:
+        break
+      if self.keep:
+        self.patchset.items.append(p)
+      if self.callback:
+        self.callback(p)
+      done.append(p)
+    return done
+
+
+def format_diffstat(stats):
+  """ format list of PatchSet.stats() tuples as diffstat """
+  stats = list(stats)
+  namelen = 0
+  maxdiff = 0  # max number of changes for single file
+               # (for histogram width calculation)
+  inserts = deletes = delta = 0
+  for name, i, d, size in stats:
+    namelen = max(namelen, len(name))
+    maxdiff = max(maxdiff, i+d)
+    inserts += i
+    deletes += d
+    delta += size
+  statlen = len(str(maxdiff))  # stats column width
+  # %-19s | %-4d %s
+  format = " %-" + str(namelen) + "s | %" + str(statlen) + "s %s\n"
+  histwidth = max(2, 80 - len(format % ('', '', '')))
+
+  output = []
+  for name, i, d, size in stats:
+    # -- calculating histogram --
+    if maxdiff < histwidth:
+      hist = "+"*i + "-"*d
+    else:
+      iratio = (float(i) / maxdiff) * histwidth
+      dratio = (float(d) / maxdiff) * histwidth
+
+      # make sure every entry gets at least one + or -
+      iwidth = 1 if 0 < iratio < 1 else int(iratio)
+      dwidth = 1 if 0 < dratio < 1 else int(dratio)
+      hist = "+"*iwidth + "-"*dwidth
+    # -- /calculating +- histogram --
+    output.append(format % (tostr(name), str(i + d), hist))
+
+  output.append(" %d files changed, %d insertions(+), %d deletions(-), %+d bytes"
+                % (len(stats), inserts, deletes, delta))
+  return "".join(output)
+
+
+def format_numstat(stats):
+  """ format list of PatchSet.stats() tuples as lines with
+      tab separated insertions, deletions and filename
+  """
+  return "".join("%d\t%d\t%s\n" % (i, d, tostr(name))
+                 for name, i, d, size in stats)
+
+
+def hunk_header(hunk, eol=b"\n"):
+  """ return @@ line for Hunk, line counts equal to 1 are
+      omitted like diff does
+  """
+  src = b"%d" % hunk.startsrc
+  if hunk.linessrc != 1:
+    src += b",%d" % hunk.linessrc
+  tgt = b"%d" % hunk.starttgt
+  if hunk.linestgt != 1:
+    tgt += b",%d" % hunk.linestgt
+  desc = b" " + hunk.desc if hunk.desc else b""
+  return b"@@ -%s +%s @@%s%s" % (src, tgt, desc, eol)
+
+
+def _raw_names(p):
+  """ return (--- line, +++ line) of Patch as they were parsed
+      or None if they are unknown or don't give current source
+      and target filenames anymore
+  """
+  if not p.rawnames:
+    return None
+  src = re_source.match(p.rawnames[0])
+  tgt = re_target.match(p.rawnames[1])
+  if not src or not tgt:
+    return None
+  parsed = dataobjects.Patch()
+  parsed.type = p.type
+  parsed.source = src.group(1).strip()
+  parsed.target = tgt.group(1).strip()
+  pathutil.normalize_patch(parsed, 0, _silent_logger)
+  if (parsed.source, parsed.target) != (p.source, p.target):
+    return None
+  return p.rawnames
+
+
+def _raw_head(hunk):
+  """ return @@ line of Hunk as it was parsed or None if it is
+      unknown or doesn't match current hunk fields anymore
+  """
+  match = hunk.rawhead and re_hunk_head.match(hunk.rawhead)
+  if not match:
+    return None
+  if (int(match.group(1)), int(match.group(3) or 1), int(match.group(4)),
+      int(match.group(6) or 1), match.group(7)[1:].rstrip()) != \
+     (hunk.startsrc, hunk.linessrc, hunk.starttgt, hunk.linestgt, hunk.desc):
+    return None
+  return hunk.rawhead
+
+
+def patch_lines(p, joined=False):
+  """ yield lines of Patch in unified diff format - header,
+      filename and @@ lines as they were in parsed patch (or
+      made of normalized source and target and hunk_header())
+      and hunks. With `joined`
+      lines of hunk bodies kept in one buffer are returned as
+      a single bytes object.
+  """
+  for line in p.header:
+    yield line
+  rawnames = _raw_names(p)
+  if rawnames:
+    srcline, tgtline = rawnames
+  else:
+    # made up lines end the same way as parsed ones
+    eol = p.rawnames[1][len(p.rawnames[1].rstrip(b"\r\n")):] \
+          if p.rawnames else b"\n"
+    source, target = p.source, p.target
+    if p.type in (variables.GIT, variables.HG):
+      # prefixes stripped by normalize_patch()
+      if source != b"/dev/null":
+        source = b"a/" + source
+      if target != b"/dev/null":
+        target = b"b/" + target
+    srcline = b"--- " + source + eol
+    tgtline = b"+++ " + target + eol
+  yield srcline
+  yield tgtline
+  eol = tgtline[len(tgtline.rstrip(b"\r\n")):] or b"\n"
+  for hunk in p.hunks:
+    yield _raw_head(hunk) or hunk_header(hunk, eol)
+    if joined and isinstance(hunk.text, buffers.LineView):
+      yield hunk.text.tobytes()
+      continue
+    for line in hunk.text:
+      yield line
+
+
+def merge_stats(stats):
+  """ sum PatchSet.stats() tuples with the same target, keeping
+      order in which targets are first seen
+  """
+  merged = {}
+  order = []
+  for name, i, d, delta in stats:
+    if name in merged:
+      mi, md, mdelta = merged[name]
+      merged[name] = (mi + i, md + d, mdelta + delta)
+    else:
+      merged[name] = (i, d, delta)
+      order.append(name)
+  return [(name,) + merged[name] for name in order]
+
+
+def _hunk_end(buf, head):
+  """ return offset after the last line of hunk, which @@ line
+      starts at `head` offset of buffer, or -1 if the hunk is
+      not complete
+  """
+  eol = buf.find(b"\n", head)
+  match = re_hunk_start.match(buf[head:eol]) if eol >= 0 else None
+  if not match:
+    return -1
+  srcleft = int(match.group(3) or 1)
+  tgtleft = int(match.group(6) or 1)
+  pos = eol + 1
+  while srcleft > 0 or tgtleft > 0:
+    c = buf[pos:pos+1]
+    if c in (b" ", b"\n", b"\r"):   # empty lines are context lines
+      srcleft -= 1
+      tgtleft -= 1
+    elif c == b"-":
+      srcleft -= 1
+    elif c == b"+":
+      tgtleft -= 1
+    elif c != b"\\":
+      return -1
+    pos = buf.find(b"\n", pos) + 1
+    if not pos:
+      return -1
+  # "\ No newline at end of file" belongs to the last line
+  if buf[pos:pos+1] == b"\\":
+    pos = buf.find(b"\n", pos) + 1 or len(buf)
+  return pos if not srcleft and not tgtleft else -1
+
+
+def _next_filenames(buf, pos):
+  """ return offset of the first "--- " line after `pos`, which
+      is followed by "+++ " line and comes after a completed
+      hunk, or -1. Used to split plain diffs without "diff" or
+      "Index:" lines.
+  """
+  while True:
+    start = buf.find(b"\n--- ", pos)
+    if start < 0:
+      return -1
+    start += 1
+    head = buf.rfind(b"\n@@ ", 0, start)
+    end = _hunk_end(buf, head + 1) if head >= 0 else -1
+    if end < 0:
+      pos = start
+    elif end > start:
+      # "--- " line is inside of the hunk, skip the rest of it
+      pos = end - 1
+    else:
+      eol = buf.find(b"\n", start)
+      if eol >= 0 and buf[eol+1:eol+5] == b"+++ ":
+        return start
+      pos = start
+
+
+def _split_points(filename, parts):
+  """ return list of byte offsets that split patch file into
+      about `parts` chunks at lines starting new file diff
+  """
+  fp = open(filename, "rb")
+  try:
+    reader = buffers.mapfile(fp)
+  finally:
+    fp.close()
+  if reader is None:
+    return [0]
+  buf = reader.buffer
+  size = len(buf)
+  points = [0]
+  for i in range(1, parts):
+    pos = max(size * i // parts, points[-1])
+    found = [x + 1 for x in (buf.find(b"\ndiff ", pos), buf.find(b"\nIndex: ", pos)) if x >= 0]
+    if not found:
+      # plain diff with filename lines only
+      found = [x for x in (_next_filenames(buf, pos),) if x >= 0]
+    if not found:
+      break
+    if min(found) > points[-1]:
+      points.append(min(found))
+  points.append(size)
+  buf.close()
+  return points
+
+
+def _parse_chunk(args):
+  """ process pool worker for PatchSet.parse_parallel(), parses
+      file chunk between offsets without finalizing patches
+
+      return (items, errors, warnings, unparsed trailing lines)
+  """
+  filename, start, end = args
+  fp = open(filename, "rb")
+  try:
+    fp.seek(start)
+    data = fp.read(end - start)
+  finally:
+    fp.close()
+  patchset = PatchSet()
+  items = list(patchset._iterparse(StringIO(data), finalize=False))
+  return items, patchset.errors, patchset.warnings, patchset._trailer
 
 
 # Legend:
@@ -5,7 +5,7 @@
 # cross-platform manner - all paths use forward
 # slashes even on Windows.
 
-import copy
+import fnmatch
 import posixpath
 import re
 import os
@@ -57,6 +57,40 @@ def pathstrip(path, n):
   while os.path.dirname(pathlist[0]) != b'':
     pathlist[0:1] = os.path.split(pathlist[0])
   return b'/'.join(pathlist[n:])
+
+def patterns(globs):
+    """ return list of shell patterns as bytes, str patterns
+        are encoded to utf-8. None is returned as is.
+    """
+    if globs is None:
+        return None
+    if isinstance(globs, (str, bytes)):
+        globs = [globs]
+    return [g.encode("utf-8") if isinstance(g, str) else g for g in globs]
+
+def match_filenames(source, target, include=None, exclude=None):
+    """ check source and target filenames of a file diff against
+        lists of `include` and `exclude` shell patterns (bytes,
+        see patterns()). Names are matched as they are in patch
+        and with a/ and b/ prefixes stripped, /dev/null is not
+        matched. Diff is selected if some name matches include
+        patterns (or include is None) and no name matches exclude
+        patterns.
+    """
+    names = []
+    for name, prefix in ((source, b"a/"), (target, b"b/")):
+        if name == b"/dev/null":
+            continue
+        names.append(xnormpath(name))
+        if name.startswith(prefix):
+            names.append(xnormpath(name[2:]))
+    if include is not None:
+        if not any(fnmatch.fnmatchcase(n, g) for n in names for g in include):
+            return False
+    if exclude:
+        if any(fnmatch.fnmatchcase(n, g) for n in names for g in exclude):
+            return False
+    return True
 # --- /Utility function ---
 
 def normalize_filenames(_items, logger: lg.Log, debugmode=False):
@@ -67,71 +101,84 @@ def normalize_filenames(_items, logger: lg.Log, debugmode=False):
 
         [x] always use forward slashes to be crossplatform
             (diff/patch were born as a unix utility after all)
+
+        patches are modified in place, only filenames are touched
         
-        return None
+        return (errors, warnings, items)
     """
     warnings = 0
     errors = 0
-    items = copy.deepcopy(_items)
+    items = _items
     if debugmode:
         logger.debug("normalize filenames")
     for i,p in enumerate(items):
-        if debugmode:
-            logger.debug("    patch type = " + p.type)
-            logger.debug("    source = " +str(p.source))
-            logger.debug("    target = " + str(p.target))
-        
-        source_null = False
-        target_null = False
-      
-        if p.type in (variables.HG, variables.GIT): # Partialy dead!
-            # TODO: figure out how to deal with /dev/null entries
-            logger.debug("stripping a/ and b/ prefixes")
-            if p.source != '/dev/null':
-                if not p.source.startswith(b"a/"):
-                    logger.warning("invalid source filename")
-                else:
-                    p.source = p.source[2:]
-            if p.target != '/dev/null':
-                if not p.target.startswith(b"b/"):
-                    logger.warning("invalid target filename")
-                else:
-                    p.target = p.target[2:]
-        
-        if p.source == b'/dev/null':
-            source_null = True
-        if p.target == b'/dev/null':
-            target_null = True
-        
-        p.source = xnormpath(p.source) if not source_null else b'/dev/null'
-        p.target = xnormpath(p.target) if not target_null else b'/dev/null'
-
-        sep = b'/'  # sep value can be hardcoded, but it looks nice this way
-
-        # references to parent are not allowed
-        if p.source.startswith(b".." + sep) and not source_null:
-            logger.warning("error: stripping parent path for source file patch no.%d" % (i+1))
-            warnings += 1
-            while p.source.startswith(b".." + sep):
-                p.source = p.source.partition(sep)[2]
-        if p.target.startswith(b".." + sep) and not target_null:
-            logger.warning("error: stripping parent path for target file patch no.%d" % (i+1))
-            warnings += 1
-            while p.target.startswith(b".." + sep):
-                p.target = p.target.partition(sep)[2]
-        # absolute paths are not allowed
-        if xisabs(p.source) or xisabs(p.target):
-            logger.warning("error: absolute paths are not allowed - file no.%d" % (i+1))
-            warnings += 1
-        if xisabs(p.source) and not source_null:
-            logger.warning("stripping absolute path from source name '%s'" % p.source)
-            p.source = xstrip(p.source)
-            warnings += 1
-        if xisabs(p.target) and not target_null:
-            logger.warning("stripping absolute path from target name '%s'" % p.target)
-            p.target = xstrip(p.target)
-            warnings += 1
+        _e, _w = normalize_patch(p, i, logger, debugmode=debugmode)
+        errors += _e
+        warnings += _w
+    return errors, warnings, items
+
+def normalize_patch(p, i, logger: lg.Log, debugmode=False):
+    """ sanitize filenames of a single Patch in place, see
+        normalize_filenames() for the rules. `i` is the index
+        of the patch in the patchset (used in messages)
+
+        return (errors, warnings)
+    """
+    warnings = 0
+    errors = 0
+    if debugmode:
+        logger.debug("    patch type = " + p.type)
+        logger.debug("    source = " +str(p.source))
+        logger.debug("    target = " + str(p.target))
+    
+    source_null = False
+    target_null = False
+  
+    if p.type in (variables.HG, variables.GIT): # Partialy dead!
+        # TODO: figure out how to deal with /dev/null entries
+        logger.debug("stripping a/ and b/ prefixes")
+        if p.source != '/dev/null':
+            if not p.source.startswith(b"a/"):
+                logger.warning("invalid source filename")
+            else:
+                p.source = p.source[2:]
+        if p.target != '/dev/null':
+            if not p.target.startswith(b"b/"):
+                logger.warning("invalid target filename")
+            else:
+                p.target = p.target[2:]
+    
+    if p.source == b'/dev/null':
+        source_null = True
+    if p.target == b'/dev/null':
+        target_null = True
     
-        items[i].source = p.source
-        items[i].target = p.target
-    return errors, warnings, items
\ No newline at end of file
+    p.source = xnormpath(p.source) if not source_null else b'/dev/null'
+    p.target = xnormpath(p.target) if not target_null else b'/dev/null'
+
+    sep = b'/'  # sep value can be hardcoded, but it looks nice this way
+
+    # references to parent are not allowed
+    if p.source.startswith(b".." + sep) and not source_null:
+        logger.warning("error: stripping parent path for source file patch no.%d" % (i+1))
+        warnings += 1
+        while p.source.startswith(b".." + sep):
+            p.source = p.source.partition(sep)[2]
+    if p.target.startswith(b".." + sep) and not target_null:
+        logger.warning("error: stripping parent path for target file patch no.%d" % (i+1))
+        warnings += 1
+        while p.target.startswith(b".." + sep):
+            p.target = p.target.partition(sep)[2]
+    # absolute paths are not allowed
+    if xisabs(p.source) or xisabs(p.target):
+        logger.warning("error: absolute paths are not allowed - file no.%d" % (i+1))
+        warnings += 1
+    if xisabs(p.source) and not source_null:
+        logger.warning("stripping absolute path from source name '%s'" % p.source)
+        p.source = xstrip(p.source)
+        warnings += 1
+    if xisabs(p.target) and not target_null:
+        logger.warning("stripping absolute path from target name '%s'" % p.target)
+        p.target = xstrip(p.target)
+        warnings += 1
+    return errors, warnings
\ No newline at end of file
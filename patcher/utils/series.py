@@ -0,0 +1,150 @@
+#------------------------------------------------
+# Patch series in mbox files
+
+# `git format-patch --stdout` output and mailing list archives
+# keep a series of commits in mbox format - messages separated
+# by "From <sha> <date>" lines. Messages are read one by one
+# and each is parsed while its lines arrive, so only one commit
+# is kept in memory no matter how long the series is.
+
+import email.parser
+import email.policy
+import email.utils
+import re
+
+from . import patch
+
+# mbox message separator, like "From <sha> Mon Sep 17 00:00:00 2001"
+re_separator = re.compile(b"^From \\S+ +\\w{3} \\w{3} +\\d+ \\d+:\\d+:\\d+ \\d{4}")
+# [PATCH v2 1/3] prefix of subject added by format-patch
+re_subject_prefix = re.compile(r"^\s*\[[^\]]*\]\s*")
+
+# git format-patch signature "-- \n2.39.2\n\n" has at most this many lines
+SIGNATURE_LINES = 3
+# git version line of the signature
+re_version = re.compile(b"^\\d+\\.\\d+\\S*\\r?\\n?$")
+
+
+def _is_signature(lines):
+  """ return True if lines after "-- " at the end of message are
+      only format-patch version trailer, so that "-- " is not
+      a hunk line that removes "- "
+  """
+  rest = [line for line in lines[1:] if line.strip(b"\r\n")]
+  return len(rest) == 1 and re_version.match(rest[0]) is not None
+
+
+class Commit(patch.PatchSet):
+  """ PatchSet parsed from one message of a series with commit
+      metadata from mail headers. `sha` is from the separator
+      line, `author` and `email` from From: header, `date` is
+      Date: header value and `subject` has [PATCH] prefix
+      removed. All of them are str (None if missing).
+  """
+
+  def __init__(self, lg=patch.default_logger, debugmode=False, include=None,
+               exclude=None):
+    patch.PatchSet.__init__(self, lg=lg, debugmode=debugmode, include=include,
+                            exclude=exclude)
+    self.sha = None
+    self.author = None
+    self.email = None
+    self.date = None
+    self.subject = None
+
+  def __repr__(self):
+    return "<Commit %s %r>" % ((self.sha or "")[:12], self.subject)
+
+
+class _MessageLines(object):
+  """ Iterator over body lines of one message, which stops at
+      the next message separator. format-patch signature at the
+      end of message is dropped, so that it is not reported as
+      unparsed data. Separator line is left in `separator`.
+  """
+
+  def __init__(self, lines):
+    self._lines = lines
+    self._pending = []   # possible signature lines
+    self._flush = []     # pending lines that were not a signature
+    self._ended = False
+    self.separator = None
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    if self._flush:
+      return self._flush.pop(0)
+    if self._ended:
+      raise StopIteration
+    while True:
+      line = next(self._lines, None)
+      if line is None or re_separator.match(line):
+        self.separator = line
+        self._ended = True
+        pending, self._pending = self._pending, []
+        if pending and not _is_signature(pending):
+          self._flush = pending
+          return self._flush.pop(0)
+        raise StopIteration
+      if line.rstrip(b"\r\n") == b"-- ":
+        # only the last "-- " line may start the signature
+        self._flush, self._pending = self._pending, [line]
+        if self._flush:
+          return self._flush.pop(0)
+      elif self._pending:
+        self._pending.append(line)
+        if len(self._pending) > SIGNATURE_LINES:
+          self._flush, self._pending = self._pending, []
+          return self._flush.pop(0)
+      else:
+        return line
+
+  next = __next__
+
+
+def _read_headers(lines):
+  """ read mail headers up to empty line, return Message """
+  headers = []
+  for line in lines:
+    if not line.strip(b"\r\n"):
+      break
+    headers.append(line)
+  return email.parser.BytesParser(policy=email.policy.default).parsebytes(
+           b"".join(headers), headersonly=True)
+
+
+def iterseries(stream, lg=patch.default_logger, debugmode=False, include=None,
+               exclude=None):
+  """ read mbox series from stream of lines and yield Commit
+      object for every message as soon as it is parsed.
+      `include` and `exclude` select files as in PatchSet.
+  """
+  lines = iter(stream)
+  separator = None
+  for line in lines:
+    if re_separator.match(line):
+      separator = line
+      break
+  else:
+    lg.warning("no messages found in patch series")
+    return
+
+  while separator is not None:
+    commit = Commit(lg=lg, debugmode=debugmode, include=include,
+                    exclude=exclude)
+    commit.sha = separator.split()[1].decode("ascii", "replace")
+    headers = _read_headers(lines)
+    author = headers.get("From")
+    if author is not None:
+      commit.author, commit.email = email.utils.parseaddr(str(author))
+    if headers.get("Date") is not None:
+      commit.date = str(headers["Date"])
+    if headers.get("Subject") is not None:
+      commit.subject = re_subject_prefix.sub("", str(headers["Subject"]))
+    commit.name = commit.subject
+    body = _MessageLines(lines)
+    commit.parse(body)
+    separator = body.separator
+    yield commit
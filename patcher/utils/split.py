@@ -0,0 +1,63 @@
+#------------------------------------------------
+# Splitting patch into per-file patches
+
+# Every file diff is written into its own .patch file as soon
+# as it is parsed and then released, so a patch of any size is
+# split in constant memory and read only once.
+
+import os
+
+from . import patch
+
+
+def output_name(p):
+  """ return relative name of .patch file for Patch - its
+      target path (source for deleted files) with .patch suffix,
+      or None if the diff has no usable filename
+  """
+  name = p.target if p.target != b"/dev/null" else p.source
+  if not name or name == b"/dev/null":
+    return None
+  return os.fsdecode(name) + ".patch"
+
+
+def _inside(filename, directory):
+  """ return True if `filename` resolves to a path under `directory` """
+  root = os.path.realpath(directory)
+  path = os.path.realpath(filename)
+  return path != root and os.path.commonpath([root, path]) == root
+
+
+def split_patches(patches, directory, lg=patch.default_logger):
+  """ write every Patch from `patches` iterable into its own
+      file in `directory`, see output_name(). Diffs for the same
+      file go to the same output. Diffs without filename or with
+      names that point outside of `directory` are skipped.
+
+      return list of written filenames
+  """
+  written = []
+  seen = set()
+  for p in patches:
+    name = output_name(p)
+    if name is None:
+      lg.warning("skipping diff without filename")
+      continue
+    filename = os.path.join(directory, name)
+    if not _inside(filename, directory):
+      lg.warning("skipping diff for %s outside of %s" % (name, directory))
+      continue
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.isdir(dirname):
+      os.makedirs(dirname)
+    mode = "ab" if filename in seen else "wb"
+    fp = open(filename, mode)
+    try:
+      fp.writelines(patch.patch_lines(p, joined=True))
+    finally:
+      fp.close()
+    if filename not in seen:
+      seen.add(filename)
+      written.append(filename)
+    lg.debug("written %s" % filename)
+  return written
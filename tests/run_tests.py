@@ -37,8 +37,21 @@ import re
 import shutil
 import unittest
 import copy
+import json
+import pickle
+import time
+import tracemalloc
+import threading
+import zlib
+import gzip
+import bz2
+import lzma
+import subprocess
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
 from os import listdir
 from os.path import abspath, dirname, exists, join, isdir, isfile
+from io import BytesIO
 from tempfile import mkdtemp
 try:
   getcwdu = os.getcwdu
@@ -249,6 +262,21 @@ class TestPatchParse(unittest.TestCase):
         pst = patch.fromstring(readstr)
         self.assertEqual(len(pst), 5)
 
+    def test_fromstring_buffers(self):
+        with open(join(TESTS, "01uni_multi/01uni_multi.patch"), "rb") as f:
+          data = f.read()
+        pst = patch.fromstring(data)
+        padded = b"junk" + data + b"junk\n"
+        for buf in (bytearray(data), memoryview(data),
+                    memoryview(padded)[4:-5], data.decode("utf-8")):
+          psb = patch.fromstring(buf)
+          self.assertEqual(psb.diffstat(), pst.diffstat())
+          for p, pb in zip(pst, psb):
+            self.assertEqual(p.header, pb.header)
+            self.assertEqual([h.text for h in p], [h.text for h in pb])
+          line = psb.items[0].hunks[0].text[0]
+          self.assertTrue(isinstance(line, bytes), type(line))
+
     def test_fromfile(self):
         pst = patch.fromfile(join(TESTS, "01uni_multi/01uni_multi.patch"))
         self.assertNotEqual(pst, False)
@@ -256,6 +284,496 @@ class TestPatchParse(unittest.TestCase):
         ps2 = patch.fromfile(testfile("failing/not-a-patch.log"))
         self.assertFalse(ps2)
 
+    def test_fromfile_mmap(self):
+        pst = patch.fromfile(join(TESTS, "01uni_multi/01uni_multi.patch"))
+        psm = patch.fromfile(join(TESTS, "01uni_multi/01uni_multi.patch"), mmap=True)
+        self.assertNotEqual(psm, False)
+        self.assertEqual(psm.diffstat(), pst.diffstat())
+        for p, pm in zip(pst, psm):
+          self.assertEqual([h.text for h in p], [h.text for h in pm])
+        hunk = psm.items[0].hunks[0]
+        self.assertTrue(isinstance(hunk.text, patch.utils.buffers.LineView))
+        self.assertEqual(hunk.text[-1], pst.items[0].hunks[0].text[-1])
+        self.assertEqual(pickle.loads(pickle.dumps(hunk.text)), hunk.text)
+
+    def test_fromfile_compressed(self):
+        filename = join(TESTS, "01uni_multi/01uni_multi.patch")
+        pst = patch.fromfile(filename)
+        with open(filename, "rb") as fp:
+          data = fp.read()
+        tmpdir = mkdtemp(prefix=self.__class__.__name__)
+        try:
+          for module in (gzip, bz2, lzma):
+            packed = join(tmpdir, "01uni_multi.patch.%s" % module.__name__)
+            with open(packed, "wb") as fp:
+              fp.write(module.compress(data))
+            for kwargs in ({}, dict(mmap=True), dict(lazy=True), dict(workers=2)):
+              psc = patch.fromfile(packed, **kwargs)
+              self.assertEqual(psc.diffstat(), pst.diffstat())
+              self.assertEqual([h.text for p in psc for h in p],
+                               [h.text for p in pst for h in p])
+            self.assertEqual([p.target for p in patch.iterfile(packed)],
+                             [p.target for p in pst])
+        finally:
+          shutil.rmtree(tmpdir)
+
+    def test_stdin_compressed(self):
+        filename = join(TESTS, "01uni_multi/01uni_multi.patch")
+        with open(filename, "rb") as fp:
+          data = fp.read()
+        expected = patch.fromfile(filename).diffstat() + "\n"
+        for compressed in (data, gzip.compress(data), lzma.compress(data)):
+          proc = subprocess.Popen([sys.executable, "-m", "patcher", "--diffstat", "--"],
+                                  cwd=dirname(TESTS), stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE)
+          out = proc.communicate(compressed)[0]
+          self.assertEqual(out.decode().replace("\r\n", "\n"), expected)
+
+    def test_push_parser(self):
+        filename = join(TESTS, "01uni_multi/01uni_multi.patch")
+        pst = patch.fromfile(filename)
+        with open(filename, "rb") as fp:
+          data = fp.read()
+        for size in (1, 5, 4096):
+          done = []
+          parser = patch.utils.patch.PushParser(callback=done.append)
+          patches = []
+          for i in range(0, len(data), size):
+            patches += parser.feed(data[i:i+size])
+            # patches are emitted before the whole input is fed
+            if i < len(data) // 2:
+              firsthalf = len(patches)
+          patches += parser.close()
+          self.assertTrue(firsthalf > 0)
+          self.assertEqual(patches, done)
+          self.assertEqual(patches, parser.patchset.items)
+          self.assertEqual(parser.patchset.diffstat(), pst.diffstat())
+          self.assertEqual([h.text for p in patches for h in p],
+                           [h.text for p in pst for h in p])
+
+        parser = patch.utils.patch.PushParser(keep=False)
+        self.assertEqual(len(parser.feed(data) + parser.close()), 5)
+        self.assertEqual(parser.patchset.items, [])
+
+    def test_compact_hunks(self):
+        pst = patch.fromfile(join(TESTS, "01uni_multi/01uni_multi.patch"))
+        p = pst.items[0]
+        h = p.hunks[0]
+        self.assertFalse(hasattr(p, '__dict__'))
+        self.assertFalse(hasattr(h, '__dict__'))
+        self.assertEqual(h.text[0], b'     lst->InsertColumn(1, _("Version"));\n')
+        self.assertEqual(len(h.text), 14)
+        # assigned lists are packed into a single buffer
+        h.text = [b' a\n', b'-b\n', b'+c\n']
+        self.assertTrue(isinstance(h.text, patch.utils.buffers.LineView))
+        self.assertEqual(list(h.text), [b' a\n', b'-b\n', b'+c\n'])
+        self.assertEqual(h.text[-1], b'+c\n')
+        self.assertEqual(h.text[1:], [b'-b\n', b'+c\n'])
+
+    def test_fromfile_lazy(self):
+        pst = patch.fromfile(join(TESTS, "01uni_multi/01uni_multi.patch"))
+        psl = patch.fromfile(join(TESTS, "01uni_multi/01uni_multi.patch"), lazy=True)
+        self.assertEqual([p.target for p in psl], [p.target for p in pst])
+        # diffstat is calculated without reading hunk bodies
+        self.assertEqual(psl.diffstat(), pst.diffstat())
+        hunk = psl.items[0].hunks[0]
+        self.assertFalse(hunk.text.loaded)
+        self.assertEqual(hunk.text, pst.items[0].hunks[0].text)
+        self.assertTrue(hunk.text.loaded)
+        for p, pl in zip(pst, psl):
+          self.assertEqual([h.text for h in p], [h.text for h in pl])
+
+    def test_lazy_expands_empty_lines(self):
+        pst = patch.fromfile(join(TESTS, "data/autofix/stripped-trailing-whitespace.diff"))
+        psl = patch.fromfile(join(TESTS, "data/autofix/stripped-trailing-whitespace.diff"), lazy=True)
+        self.assertEqual(psl.warnings, pst.warnings)
+        for p, pl in zip(pst, psl):
+          self.assertEqual([h.text for h in p], [h.text for h in pl])
+
+    def test_parse_parallel(self):
+        lines = []
+        for fileno in range(40):
+          lines.append(b"diff --git a/f%d.txt b/f%d.txt\n" % (fileno, fileno))
+          lines.append(b"index 1234567..89abcde 100644\n")
+          lines.append(b"--- a/f%d.txt\n+++ b/f%d.txt\n" % (fileno, fileno))
+          lines.append(b"@@ -1,3 +1,3 @@\n line\n-old\n+new\n line\n")
+          if fileno % 3 == 0:
+            lines.append(b"\\ No newline at end of file\n")
+        tmpdir = mkdtemp(prefix="parallel.")
+        try:
+          filename = join(tmpdir, "many.diff")
+          with open(filename, "wb") as f:
+            f.write(b"".join(lines))
+          pst = patch.fromfile(filename)
+          psp = patch.fromfile(filename, workers=2)
+          self.assertNotEqual(psp, False)
+          self.assertEqual(psp.type, pst.type)
+          self.assertEqual(psp.errors, pst.errors)
+          self.assertEqual(psp.warnings, pst.warnings)
+          self.assertEqual([(p.source, p.target, p.type, p.header) for p in psp],
+                           [(p.source, p.target, p.type, p.header) for p in pst])
+          self.assertEqual([[h.text for h in p] for p in psp],
+                           [[h.text for h in p] for p in pst])
+        finally:
+          shutil.rmtree(tmpdir)
+
+    def test_parse_parallel_plain(self):
+        lines = []
+        for fileno in range(40):
+          lines.append(b"--- f%d.txt\t2020-01-01\n+++ f%d.txt\t2020-01-02\n" % (fileno, fileno))
+          # hunk lines that look like filename lines are not split points
+          lines.append(b"@@ -1,3 +1,3 @@\n line\n--- old\n+++ new\n line\n")
+        tmpdir = mkdtemp(prefix="parallel.")
+        try:
+          filename = join(tmpdir, "plain.diff")
+          with open(filename, "wb") as f:
+            f.write(b"".join(lines))
+          points = patch.utils.patch._split_points(filename, 8)
+          self.assertTrue(len(points) > 2)
+          data = b"".join(lines)
+          for point in points[1:-1]:
+            self.assertEqual(data[point:point+5], b"--- f")
+          pst = patch.fromfile(filename)
+          psp = patch.fromfile(filename, workers=2)
+          self.assertNotEqual(psp, False)
+          self.assertEqual((psp.errors, psp.warnings), (pst.errors, pst.warnings))
+          self.assertEqual([(p.source, p.target, p.header) for p in psp],
+                           [(p.source, p.target, p.header) for p in pst])
+          self.assertEqual([[list(h.text) for h in p] for p in psp],
+                           [[list(h.text) for h in p] for p in pst])
+        finally:
+          shutil.rmtree(tmpdir)
+
+    def test_parse_peak_memory(self):
+        # filenames are normalized in place, so parsing doesn't
+        # need a second copy of parsed patches at the end
+        lines = []
+        for fileno in range(200):
+          lines.append(b"--- a%d.txt\n+++ a%d.txt\n" % (fileno, fileno))
+          for hunkno in range(10):
+            lines.append(b"@@ -%d,7 +%d,7 @@\n" % (hunkno*10+1, hunkno*10+1))
+            lines.append(b" context\n"*3 + b"-old line\n+new line\n" + b" context\n"*3)
+        data = b"".join(lines)
+
+        tracemalloc.start()
+        try:
+          pst = patch.utils.patch.PatchSet(BytesIO(data))
+          current, peak = tracemalloc.get_traced_memory()
+        finally:
+          tracemalloc.stop()
+        self.assertEqual(len(pst), 200)
+        self.assertTrue(peak < current * 1.2, "peak %d, retained %d" % (peak, current))
+
+        tracemalloc.start()
+        try:
+          items = pst.items
+          patch.utils.pathutil.normalize_filenames(items, pst.logger)
+          current, peak = tracemalloc.get_traced_memory()
+        finally:
+          tracemalloc.stop()
+        self.assertTrue(peak < len(data) / 10, "peak %d" % peak)
+        self.assertTrue(items is pst.items)
+
+    def test_spilled_hunks(self):
+        count = 20000
+        data = (b"--- big.txt\n+++ big.txt\n@@ -1,%d +1,%d @@\n" % (count, count)
+                + b"".join(b"-old line %d\n+new line %d\n" % (i, i) for i in range(count)))
+        tracemalloc.start()
+        try:
+          pss = patch.utils.patch.PatchSet(BytesIO(data), spillsize=2**14)
+          current, peak = tracemalloc.get_traced_memory()
+        finally:
+          tracemalloc.stop()
+        self.assertTrue(peak < len(data) / 4, "peak %d, data %d" % (peak, len(data)))
+        text = pss.items[0].hunks[0].text
+        self.assertTrue(isinstance(text, patch.utils.buffers.SpilledLines))
+        pst = patch.utils.patch.PatchSet(BytesIO(data))
+        self.assertEqual(pss.diffstat(), pst.diffstat())
+        self.assertEqual(len(text), count * 2)
+        self.assertEqual(text[-1], b"+new line %d\n" % (count - 1))
+        self.assertEqual(text, pst.items[0].hunks[0].text)
+        # small hunks stay in memory
+        small = b"--- big.txt\n+++ big.txt\n@@ -1 +1 @@\n-old\n+new\n"
+        pss = patch.utils.patch.PatchSet(BytesIO(small), spillsize=2**16)
+        self.assertTrue(isinstance(pss.items[0].hunks[0].text, patch.utils.buffers.LineView))
+
+    @unittest.skipIf(patch.utils.accel.numpy is None, "numpy is not installed")
+    def test_accel_scan(self):
+        count = 500
+        data = (b"--- big.txt\n+++ big.txt\n@@ -1,%d +1,%d @@\n" % (count + 1, count + 1)
+                + b"".join(b"-old %d\r\n+new line %d\n" % (i, i) for i in range(count))
+                + b" same\n\\ No newline at end of file\n")
+        accel = patch.utils.accel
+        psa = patch.fromstring(data)
+        self.assertTrue(isinstance(psa.items[0].hunks[0].text, patch.utils.buffers.LineView))
+        numpy, accel.numpy = accel.numpy, None
+        try:
+          psp = patch.fromstring(data)
+        finally:
+          accel.numpy = numpy
+        self.assertEqual(psa.items[0].hunks[0].text, psp.items[0].hunks[0].text)
+        self.assertEqual(psa.items[0].hunkends, psp.items[0].hunkends)
+        self.assertEqual(psa.diffstat(), psp.diffstat())
+        # stats from hunk lines if parser didn't count them
+        for hunk in psa.items[0].hunks:
+          hunk.inserts = None
+        self.assertEqual(psa.stats(), psp.stats())
+
+    def test_include_exclude(self):
+        pto = patch.fromfile(join(TESTS, "01uni_multi/01uni_multi.patch"),
+                             include=["*.h"])
+        self.assertEqual([p.target for p in pto], [b"updatedlg.h", b"conf.h"])
+        self.assertEqual(pto.skipped, 3)
+        self.assertEqual(pto.items[1].header[0], b'Index: conf.h\r\n')
+        full = patch.fromfile(join(TESTS, "01uni_multi/01uni_multi.patch"))
+        self.assertEqual(pto.items[1].hunks[0].text, full.items[4].hunks[0].text)
+        # git a/ b/ prefixes are optional in patterns
+        pto = patch.fromfile(testfile("git-changed-file.diff"), exclude="*.py")
+        self.assertEqual(len(pto), 0)
+        self.assertEqual(pto.errors, 0)
+        pto = patch.fromfile(testfile("git-changed-file.diff"), include=["b/*.py"],
+                             exclude=[b"tests/*"])
+        self.assertEqual([p.target for p in pto], [b"jsonpickle/__init__.py"])
+
+    def test_iterseries(self):
+        commits = list(patch.iterseries(testfile("git-format-patch.mbox")))
+        self.assertEqual(len(commits), 2)
+        first, second = commits
+        self.assertEqual(first.sha, "0f3a1c2e4b5d6a7980f1e2d3c4b5a69788796a5b")
+        self.assertEqual(first.subject, "Sort keys of JSON output")
+        self.assertEqual((first.author, first.email), ("John Doe", "john@example.com"))
+        self.assertEqual(second.subject, "Test references in pickled collections")
+        self.assertEqual(second.author, "J\u00fcrgen M\u00fcller")
+        # "From" in commit message is not a separator, signature is not a trailer
+        self.assertTrue(b"From now on output is stable.\n" in first.items[0].header)
+        for commit in commits:
+            self.assertEqual((commit.errors, commit.warnings), (0, 0))
+            self.assertEqual(commit.type, patch.utils.variables.GIT)
+        full = patch.fromfile(testfile("git-changed-2-files.diff"))
+        self.assertEqual([p.target for c in commits for p in c],
+                         [p.target for p in full])
+        self.assertEqual(second.items[0].hunks[0].text, full.items[1].hunks[0].text)
+
+    def test_iterseries_dash_hunk_line(self):
+        def message(sha, body):
+            return (b"From %s Mon Sep 17 00:00:00 2001\n" % sha +
+                    b"From: A <a@example.com>\nSubject: [PATCH] x\n\n" + body)
+        hunk = (b"diff --git a/f b/f\n--- a/f\n+++ b/f\n"
+                b"@@ -1,2 +1 @@\n x\n-- \n")
+        data = (message(b"1" * 40, hunk + b"-- \n2.39.2\n\n") +
+                message(b"2" * 40, hunk))
+        commits = list(patch.utils.series.iterseries(BytesIO(data)))
+        self.assertEqual(len(commits), 2)
+        for commit in commits:
+            self.assertEqual((commit.errors, commit.warnings), (0, 0))
+            hunk = commit.items[0].hunks[0]
+            self.assertFalse(hunk.invalid)
+            self.assertEqual(list(hunk.text), [b" x\n", b"-- \n"])
+
+    def test_limits(self):
+        Limits = patch.utils.dataobjects.Limits
+        filename = join(TESTS, "01uni_multi/01uni_multi.patch")
+        self.assertTrue(patch.fromfile(filename, limits=Limits(max_files=5)))
+        self.assertFalse(patch.fromfile(filename, limits=Limits(max_files=2)))
+        for limits, name, parsed in ((Limits(max_files=2), "max_files", 2),
+                                     (Limits(max_hunks=3), "max_hunks", 1),
+                                     (Limits(max_hunk_lines=20), "max_hunk_lines", 0),
+                                     (Limits(max_header_lines=1), "max_header_lines", 0),
+                                     (Limits(max_bytes=3000), "max_bytes", 2)):
+            pto = patch.utils.patch.PatchSet(limits=limits)
+            with open(filename, "rb") as fp:
+                self.assertFalse(pto.parse(fp))
+            self.assertEqual(pto.limited, name)
+            self.assertEqual(pto.errors, 1)
+            # only complete patches are kept
+            self.assertEqual(len(pto), parsed)
+        pto = patch.fromstring(b"--- a\n+++ b\n@@ -1,1000000000 +1 @@\n-x\n",
+                               limits=Limits(max_hunk_lines=10**6))
+        self.assertFalse(pto)
+        # byte and time limits stop long header and hunk body
+        header = b"junk line\n" * 200000 + b"--- a\n+++ b\n"
+        lines = 500000
+        hunk = (b"--- a\n+++ b\n@@ -1,%d +1,%d @@\n" % (lines, lines)
+                + b" context line\n" * lines)
+        for data, limits, name in ((header, Limits(max_bytes=1000), "max_bytes"),
+                                   (header, Limits(max_time=0), "max_time"),
+                                   (hunk, Limits(max_bytes=1000), "max_bytes")):
+            for stream in (patch.utils.buffers.BufferReader(data), BytesIO(data)):
+                pto = patch.utils.patch.PatchSet(limits=limits)
+                self.assertFalse(pto.parse(stream))
+                self.assertTrue(stream.tell() < len(data) // 10)
+                self.assertEqual(pto.limited, name)
+                self.assertEqual(len(pto), 0)
+        # line without newline is not read past the limit
+        blob = b"--- a\n+++ b\n" + b"x" * 2**22
+        for data in (blob, b"junk\n" + blob[12:]):
+            stream = BytesIO(data)
+            pto = patch.utils.patch.PatchSet(limits=Limits(max_bytes=1000))
+            self.assertFalse(pto.parse(stream))
+            self.assertEqual(pto.limited, "max_bytes")
+            self.assertTrue(stream.tell() <= 1001)
+        pto = patch.utils.patch.PatchSet(limits=Limits(max_bytes=len(blob)))
+        self.assertFalse(pto.parse(BytesIO(blob)))
+        self.assertEqual(pto.limited, None)
+
+    def test_compress_hunks(self):
+        pto = patch.fromfile(join(TESTS, "01uni_multi/01uni_multi.patch"))
+        lines = [[list(h.text) for h in p] for p in pto]
+        diffstat = pto.diffstat()
+        total, compressed = pto.compress_hunks()
+        self.assertEqual(total, sum(len(l) for p in lines for h in p for l in h))
+        self.assertTrue(compressed < total)
+        text = pto.items[0].hunks[1].text
+        self.assertTrue(isinstance(text, patch.utils.buffers.CompressedLines))
+        self.assertEqual(len(text), len(lines[0][1]))
+        self.assertEqual(text[-1], lines[0][1][-1])
+        self.assertEqual([[list(h.text) for h in p] for p in pto], lines)
+        self.assertEqual(pto.diffstat(), diffstat)
+        cache = patch.utils.buffers.blob_cache
+        self.assertTrue(len(cache._data) <= cache.size)
+        copied = pickle.loads(pickle.dumps(pto))
+        self.assertEqual([[list(h.text) for h in p] for p in copied], lines)
+
+    def test_split(self):
+        filename = join(TESTS, "01uni_multi/01uni_multi.patch")
+        tmpdir = mkdtemp(prefix="split-")
+        try:
+            written = patch.split(filename, tmpdir)
+            names = [p.target.decode() + ".patch" for p in patch.fromfile(filename)]
+            self.assertEqual(written, [join(tmpdir, n) for n in names])
+            data = b"".join(open(w, "rb").read() for w in written)
+            self.assertEqual(data, open(filename, "rb").read())
+            pto = patch.fromfile(join(tmpdir, "conf.h.patch"))
+            self.assertEqual([p.target for p in pto], [b"conf.h"])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_split_unsafe_names(self):
+        data = (b"--- /dev/null\n+++ /dev/null\n@@ -0,0 +1 @@\n+a\n"
+                b"--- a/../escape\n+++ b/../escape\n@@ -1 +1 @@\n-a\n+b\n"
+                b"--- /tmp/abs\n+++ /tmp/abs\n@@ -1 +1 @@\n-a\n+b\n"
+                b"--- link/x\n+++ link/x\n@@ -1 +1 @@\n-a\n+b\n")
+        tmpdir = mkdtemp(prefix="split-")
+        try:
+            outdir = join(tmpdir, "out")
+            os.makedirs(join(tmpdir, "elsewhere"))
+            os.makedirs(outdir)
+            os.symlink(join(tmpdir, "elsewhere"), join(outdir, "link"))
+            pset = patch.utils.patch.PatchSet()
+            written = patch.utils.split.split_patches(
+                        pset.iterparse(BytesIO(data)), outdir)
+            self.assertEqual(written, [join(outdir, "escape.patch"),
+                                       join(outdir, "tmp/abs.patch")])
+            self.assertEqual(sorted(os.listdir(tmpdir)), ["elsewhere", "out"])
+            self.assertEqual(os.listdir(join(tmpdir, "elsewhere")), [])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_export_ndjson(self):
+        filename = join(TESTS, "01uni_multi/01uni_multi.patch")
+        pto = patch.fromfile(filename)
+        out = BytesIO()
+        with open(filename, "rb") as fp:
+            count = patch.utils.export.write_ndjson(
+                      patch.utils.patch.PatchSet().iterparse(fp), out, lines=True)
+        self.assertEqual(count, len(pto))
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        files = [r for r in records if r["record"] == "file"]
+        hunks = [r for r in records if r["record"] == "hunk"]
+        self.assertEqual([(r["target"], r["inserts"], r["deletes"], r["delta"]) for r in files],
+                         [(t.decode(), i, d, delta) for t, i, d, delta in pto.stats()])
+        self.assertEqual(len(hunks), sum(len(p.hunks) for p in pto))
+        first = pto.items[0].hunks[0]
+        self.assertEqual((hunks[0]["startsrc"], hunks[0]["linestgt"]),
+                         (first.startsrc, first.linestgt))
+        self.assertEqual(hunks[0]["lines"], [l.decode() for l in first.text])
+
+    def test_write_roundtrip(self):
+        for name in ("01uni_multi/01uni_multi.patch", "data/git-changed-2-files.diff",
+                     "data/hg-exported.diff", "data/svn-changed-2-files.diff"):
+            with open(join(TESTS, name), "rb") as fp:
+                data = fp.read()
+            pto = patch.fromstring(data)
+            self.assertEqual(pto.to_bytes(), data)
+            out = BytesIO()
+            pto.write(out, bufsize=64)
+            self.assertEqual(out.getvalue(), data)
+        # @@ lines are kept as they are
+        for data in (b"--- a\n+++ b\n@@ -1,1 +1,1 @@\n-x\n+y\n",
+                     b"--- a\n+++ b\n@@ -1 +1 @@\tdesc \n-x\n+y\n",
+                     b"--- a\n+++ b\n@@ -1 +1 @@ desc\r\n-x\n+y\n"):
+            pto = patch.fromstring(data)
+            self.assertEqual(pto.to_bytes(), data)
+            pto = patch.utils.patch.PatchSet(BytesIO(data))
+            self.assertEqual(pto.to_bytes(), data)
+        # filename and @@ lines are made of source, target and
+        # hunk fields if not known
+        pto = patch.fromstring(b"--- a\n+++ b\n@@ -1,1 +1,2 @@ desc\n-x\n+y\n+z\n")
+        pto.items[0].rawnames = None
+        pto.items[0].hunks[0].rawhead = None
+        self.assertEqual(pto.to_bytes(), b"--- a\n+++ b\n@@ -1 +1,2 @@ desc\n-x\n+y\n+z\n")
+
+    def test_write_edited(self):
+        data = (b"diff --git a/f b/f\n--- a/f\t2020\n+++ b/f\t2020\n"
+                b"@@ -1,2 +1,2 @@ func\n x\n-y\n+z\n"
+                b"@@ -10 +10 @@\n-a\n+b\n")
+        pto = patch.fromstring(data)
+        p = pto.items[0]
+        self.assertEqual(p.source, b"f")
+        # unchanged names and hunks keep their lines
+        self.assertEqual(pto.to_bytes(), data)
+        p.source = p.target = b"g"
+        first, second = p.hunks
+        first.startsrc = first.starttgt = 5
+        second.text = [b"-a\n", b"+b\n", b"+c\n"]
+        second.linestgt = 2
+        out = pto.to_bytes()
+        self.assertTrue(b"\n--- a/g\n+++ b/g\n" in out)
+        self.assertTrue(b"@@ -5,2 +5,2 @@ func\n" in out)
+        self.assertTrue(b"@@ -10 +10,2 @@\n" in out)
+        parsed = patch.fromstring(out)
+        self.assertEqual([(q.source, q.target) for q in parsed], [(b"g", b"g")])
+        self.assertEqual([(h.startsrc, h.linessrc, h.starttgt, h.linestgt, h.desc,
+                           list(h.text)) for h in parsed.items[0]],
+                         [(h.startsrc, h.linessrc, h.starttgt, h.linestgt, h.desc,
+                           list(h.text)) for h in p])
+        # text setter drops parsed @@ line even if counts are kept
+        second.text = [b"-a\n", b"+b\n", b"+d\n"]
+        self.assertEqual(second.rawhead, None)
+
+    def test_numstat_and_patch_stats(self):
+        pto = patch.fromfile(join(TESTS, "01uni_multi/01uni_multi.patch"))
+        self.assertEqual(pto.items[0].stats(), (18, 2, pto.stats()[0][3]))
+        self.assertEqual(pto.items[0].stats(),
+                         tuple(map(sum, zip(*[h.stats() for h in pto.items[0]]))))
+        self.assertEqual(pto.numstat().splitlines()[:2],
+                         ["18\t2\tupdatedlg.cpp", "1\t0\tupdatedlg.h"])
+        out = subprocess.check_output([sys.executable, "-m", "patcher", "--numstat",
+                                       join(TESTS, "01uni_multi/01uni_multi.patch")],
+                                      cwd=dirname(TESTS))
+        self.assertEqual(out.decode().replace("\r\n", "\n"), pto.numstat())
+        # stats are counted from lines if unknown
+        hunk = pto.items[0].hunks[0]
+        expected = hunk.stats()
+        hunk.text = list(hunk.text)
+        self.assertEqual(hunk.inserts, None)
+        self.assertEqual(hunk.stats(), expected)
+
+    def test_statsonly(self):
+        count = 20000
+        data = (b"--- big.txt\n+++ big.txt\n@@ -1,%d +1,%d @@\n" % (count, count)
+                + b"".join(b"-old line %d\n+new line %d\n" % (i, i) for i in range(count)))
+        tracemalloc.start()
+        try:
+          pss = patch.utils.patch.PatchSet(BytesIO(data), statsonly=True)
+          current, peak = tracemalloc.get_traced_memory()
+        finally:
+          tracemalloc.stop()
+        self.assertTrue(peak < len(data) / 10, "peak %d, data %d" % (peak, len(data)))
+        self.assertEqual(len(pss.items[0].hunks[0].text), 0)
+        pst = patch.utils.patch.PatchSet(BytesIO(data))
+        self.assertEqual(pss.diffstat(), pst.diffstat())
+
     def test_no_header_for_plain_diff_with_single_file(self):
         pto = patch.fromfile(join(TESTS, "03trail_fname.patch"))
         self.assertEqual(pto.items[0].header, [])
@@ -289,6 +807,64 @@ class TestPatchParse(unittest.TestCase):
         self.assertEqual(pto.errors, 0)
         self.assertEqual(pto.warnings, 4)
 
+    def test_iterparse(self):
+        pto = patch.fromfile(join(TESTS, "01uni_multi/01uni_multi.patch"))
+        ps = patch.utils.patch.PatchSet()
+        fp = open(join(TESTS, "01uni_multi/01uni_multi.patch"), "rb")
+        try:
+          items = list(ps.iterparse(fp))
+        finally:
+          fp.close()
+        self.assertEqual(len(ps.items), 0)
+        self.assertEqual([(p.source, p.target, p.type) for p in items],
+                         [(p.source, p.target, p.type) for p in pto.items])
+        self.assertEqual([[h.text for h in p] for p in items],
+                         [[h.text for h in p] for p in pto.items])
+        self.assertEqual(ps.type, pto.type)
+        self.assertEqual(ps.errors, 0)
+
+    def test_iterfile(self):
+        items = list(patch.iterfile(testfile("hg-changed-2-files.diff")))
+        self.assertEqual(len(items), 2)
+        self.assertEqual(items[0].type, patch.utils.variables.HG)
+        # filenames are already normalized
+        self.assertFalse(items[0].source.startswith(b"a/"))
+
+    def test_fastpath_throughput(self):
+        # synthetic patch with many hunks, parsed with and
+        # without bulk hunk body consumption
+        lines = []
+        for fileno in range(50):
+          lines.append(b"--- a%d.txt\n+++ a%d.txt\n" % (fileno, fileno))
+          for hunkno in range(40):
+            lines.append(b"@@ -%d,7 +%d,7 @@\n" % (hunkno*10+1, hunkno*10+1))
+            lines.append(b" context\n"*3 + b"-old line\n+new line\n" + b" context\n"*3)
+        data = b"".join(lines)
+
+        timings = {}
+        results = {}
+        for fastpath in (False, True):
+          pst = patch.utils.patch.PatchSet()
+          pst.fastpath = fastpath
+          started = time.time()
+          self.assertTrue(pst.parse(BytesIO(data)))
+          timings[fastpath] = time.time() - started
+          results[fastpath] = [[(h.startsrc, h.text) for h in p] for p in pst]
+        self.assertEqual(results[True], results[False])
+        if verbose:
+          print("\nparse throughput: %.1f MB/s before, %.1f MB/s after"
+                % (len(data) / timings[False] / 2**20, len(data) / timings[True] / 2**20))
+
+    def test_fastpath_fallback(self):
+        # empty line expansion and missing lines go through the state machine
+        pto = patch.fromfile(join(TESTS, "data/autofix/stripped-trailing-whitespace.diff"))
+        self.assertEqual(pto.errors, 0)
+        self.assertEqual(pto.warnings, 4)
+        fp = open(join(TESTS, "data/failing/missing-hunk-line.diff"), 'rb')
+        pst = patch.utils.patch.PatchSet()
+        self.assertNotEqual(pst.parse(fp), True)
+        fp.close()
+
     def test_fail_missing_hunk_line(self):
         fp = open(join(TESTS, "data/failing/missing-hunk-line.diff"), 'rb')
         pto = patch.PatchSet()
@@ -319,6 +895,288 @@ class TestPatchParse(unittest.TestCase):
         self.assertEqual(pto.diffstat(), output, "Output doesn't match")
 
 
+class TestParseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp(prefix=self.__class__.__name__)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cache_roundtrip(self):
+        filename = join(TESTS, "01uni_multi/01uni_multi.patch")
+        pst = patch.fromfile(filename, cache_dir=self.tmpdir)
+        self.assertEqual(len(listdir(self.tmpdir)), 1)
+        cache = patch.utils.cache.ParseCache(self.tmpdir)
+        res, psc = cache.load(cache.key(filename))
+        self.assertTrue(res)
+        self.assertEqual(psc.type, pst.type)
+        self.assertEqual((psc.errors, psc.warnings), (pst.errors, pst.warnings))
+        self.assertEqual(psc.diffstat(), pst.diffstat())
+        for p, pc in zip(pst, psc):
+          self.assertEqual(p.header, pc.header)
+          self.assertEqual([h.text for h in p], [h.text for h in pc])
+        psc = patch.fromfile(filename, cache_dir=self.tmpdir)
+        self.assertEqual(psc.diffstat(), pst.diffstat())
+        self.assertEqual(psc.to_bytes(), pst.to_bytes())
+        filename = join(TESTS, "data/git-dash-in-filename.diff")
+        patch.fromfile(filename, cache_dir=self.tmpdir)
+        psc = patch.fromfile(filename, cache_dir=self.tmpdir)
+        self.assertEqual(psc.to_bytes(), open(filename, "rb").read())
+
+    def test_cache_failed_parse(self):
+        filename = testfile("failing/not-a-patch.log")
+        self.assertFalse(patch.fromfile(filename, cache_dir=self.tmpdir))
+        self.assertFalse(patch.fromfile(filename, cache_dir=self.tmpdir))
+
+    def test_cache_version(self):
+        filename = testfile("git-changed-file.diff")
+        cache = patch.utils.cache.ParseCache(self.tmpdir)
+        key = cache.key(filename)
+        patch.fromfile(filename, cache_dir=self.tmpdir)
+        self.assertNotEqual(cache.load(key), None)
+        saved = patch.utils.cache.CACHE_VERSION
+        patch.utils.cache.CACHE_VERSION = saved + 1
+        try:
+          self.assertNotEqual(cache.key(filename), key)
+          self.assertEqual(cache.load(key), None)
+        finally:
+          patch.utils.cache.CACHE_VERSION = saved
+
+    def test_cache_eviction(self):
+        cache = patch.utils.cache.ParseCache(self.tmpdir, maxsize=0)
+        filename = testfile("git-changed-file.diff")
+        pst = patch.fromfile(filename)
+        cache.store(cache.key(filename), True, pst)
+        self.assertEqual(listdir(self.tmpdir), [])
+
+
+class TestContainer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp(prefix=self.__class__.__name__)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _assert_same(self, pst, psc):
+        self.assertEqual(psc.type, pst.type)
+        self.assertEqual((psc.errors, psc.warnings), (pst.errors, pst.warnings))
+        self.assertEqual(len(psc), len(pst))
+        for p, pc in zip(pst, psc):
+          self.assertEqual((p.source, p.target, p.type, p.header, p.hunkends, p.rawnames),
+                           (pc.source, pc.target, pc.type, pc.header, pc.hunkends, pc.rawnames))
+          self.assertEqual([(h.startsrc, h.linessrc, h.starttgt, h.linestgt,
+                             h.invalid, h.desc, h.rawhead, h.text, h.inserts, h.deletes, h.delta) for h in p],
+                           [(h.startsrc, h.linessrc, h.starttgt, h.linestgt,
+                             h.invalid, h.desc, h.rawhead, h.text, h.inserts, h.deletes, h.delta) for h in pc])
+
+    def test_roundtrip(self):
+        filename = join(self.tmpdir, "saved.ptch")
+        for name in ["01uni_multi/01uni_multi.patch", "data/hg-exported.diff",
+                     "data/git-changed-2-files.diff"]:
+          pst = patch.fromfile(join(TESTS, name))
+          pst.save(filename)
+          self._assert_same(pst, patch.fromcontainer(filename))
+          self._assert_same(pst, patch.fromcontainer(filename, mmap=True))
+
+    def test_to_bytes(self):
+        filename = join(self.tmpdir, "saved.ptch")
+        for name in ["data/git-changed-2-files.diff", "data/git-dash-in-filename.diff",
+                     "02uni_newline.patch"]:
+          with open(join(TESTS, name), "rb") as fp:
+            data = fp.read()
+          patch.fromfile(join(TESTS, name)).save(filename)
+          self.assertEqual(patch.fromcontainer(filename).to_bytes(), data)
+          self.assertEqual(patch.fromcontainer(filename, mmap=True).to_bytes(), data)
+
+    def test_not_a_container(self):
+        self.assertFalse(patch.fromcontainer(join(TESTS, "01uni_multi/01uni_multi.patch")))
+
+
+class PatchRequestHandler(BaseHTTPRequestHandler):
+    """ serves files from TESTS with Content-Encoding given
+        in query string (?gzip or ?deflate) """
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        path, _, encoding = self.path.partition("?")
+        filename = join(TESTS, path.lstrip("/"))
+        if not isfile(filename):
+          self.send_error(404)
+          return
+        with open(filename, "rb") as fp:
+          data = fp.read()
+        if encoding == "gzip":
+          data = gzip.compress(data)
+        elif encoding == "deflate":
+          data = zlib.compress(data)
+        self.send_response(200)
+        if encoding:
+          self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class PatchServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    connections = 0
+
+
+class TestFromURL(unittest.TestCase):
+    def setUp(self):
+        self.server = PatchServer(("127.0.0.1", 0), PatchRequestHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs=dict(poll_interval=0.05))
+        self.thread.start()
+        self.base = "http://127.0.0.1:%d/" % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def _assertSame(self, pst, ps):
+        self.assertEqual(pst.type, ps.type)
+        self.assertEqual(len(pst), len(ps))
+        for p, pu in zip(pst, ps):
+          self.assertEqual(p.header, pu.header)
+          self.assertEqual([h.text for h in p], [h.text for h in pu])
+
+    def test_fromurl_encodings(self):
+        name = "01uni_multi/01uni_multi.patch"
+        pst = patch.fromfile(join(TESTS, name))
+        for encoding in ("", "gzip", "deflate"):
+          ps = patch.fromurl(self.base + name + "?" + encoding, bufsize=64)
+          self._assertSame(pst, ps)
+        self.assertEqual([p.target for p in pst],
+                         [p.target for p in patch.iterurl(self.base + name + "?gzip")])
+
+    def test_fromurls_reuses_connections(self):
+        names = ["01uni_multi/01uni_multi.patch", "data/git-changed-file.diff",
+                 "data/hg-exported.diff"] * 10
+        res = patch.fromurls([self.base + n + "?gzip" for n in names], workers=2)
+        self.assertEqual(len(res), len(names))
+        for name, ps in zip(names, res):
+          self._assertSame(patch.fromfile(join(TESTS, name)), ps)
+        self.assertTrue(self.server.connections <= 2, self.server.connections)
+
+    def test_fromurls_errors(self):
+        res = patch.fromurls([self.base + "missing.diff",
+                              self.base + "data/git-changed-file.diff"])
+        self.assertFalse(res[0])
+        self.assertTrue(res[1])
+
+
+class TestBatchParse(unittest.TestCase):
+    def test_fromfiles(self):
+        names = [testfile("git-changed-file.diff"), testfile("missing.diff"),
+                 testfile("failing/not-a-patch.log"), testfile("hg-exported.diff")]
+        for workers in (None, 2):
+          res = patch.fromfiles(names, workers=workers)
+          self.assertEqual([r.filename for r in res], names)
+          self.assertEqual([r.ok for r in res], [True, False, False, True])
+          self.assertTrue(res[1].error)
+          self.assertEqual(res.failed, [res[1], res[2]])
+          self.assertEqual(res[0].patchset.diffstat(),
+                           patch.fromfile(names[0]).diffstat())
+
+    def test_fromfiles_broken_archives(self):
+        with open(testfile("git-changed-file.diff"), "rb") as fp:
+          data = fp.read() * 50
+        gz = gzip.compress(data)
+        broken = [("truncated.diff.gz", gz[:len(gz) // 2]),
+                  ("truncated.diff.xz", lzma.compress(data)[:-20]),
+                  ("corrupt.diff.gz", gz[:20] + b"\xff" * 40 + gz[60:])]
+        tmpdir = mkdtemp(prefix=self.__class__.__name__)
+        try:
+          names = []
+          for name, blob in broken:
+            names.append(join(tmpdir, name))
+            with open(names[-1], "wb") as fp:
+              fp.write(blob)
+          names.append(testfile("git-changed-file.diff"))
+          res = patch.fromfiles(names)
+          self.assertEqual([r.ok for r in res], [False, False, False, True])
+          self.assertTrue(all(r.error for r in res[:3]))
+        finally:
+          shutil.rmtree(tmpdir)
+
+    def test_fromdir_diffstat(self):
+        res = patch.fromdir(TESTDATA, "*.diff", workers=2, statsonly=True,
+                            recursive=False)
+        names = sorted(join(TESTDATA, n) for n in listdir(TESTDATA)
+                       if n.endswith(".diff"))
+        self.assertEqual([r.filename for r in res], names)
+        self.assertTrue(all(r.patchset is None for r in res))
+        stats = patch.utils.patch.merge_stats(
+          s for n in names for s in patch.fromfile(n).stats())
+        self.assertEqual(res.stats(), stats)
+        self.assertEqual(res.diffstat(), patch.utils.patch.format_diffstat(stats))
+        self.assertEqual(len(patch.fromdir(TESTS, "*.patch", recursive=False)), 5)
+        self.assertEqual(len(patch.fromdir(TESTS, "*.patch")), 7)
+
+
+class TestPatchIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp(prefix=self.__class__.__name__)
+        self.filename = join(self.tmpdir, "01uni_multi.patch")
+        shutil.copy(join(TESTS, "01uni_multi/01uni_multi.patch"), self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_open_indexed(self):
+        pst = patch.fromfile(self.filename)
+        idx = patch.utils.patch.PatchSet.open_indexed(self.filename)
+        self.assertTrue(exists(self.filename + ".patchidx"))
+        self.assertEqual(list(idx), [(p.source, p.target) for p in pst])
+        self.assertEqual(idx.load().diffstat(), pst.diffstat())
+        for i, p in enumerate(pst):
+          ps = idx.load([p.target])
+          self.assertEqual(len(ps), 1)
+          self.assertEqual(ps.items[0].header, p.header)
+          self.assertEqual([h.text for h in ps.items[0]], [h.text for h in p])
+          entry = idx.find(p.target)[0]
+          self.assertEqual(len(entry["hunks"]), len(p.hunks))
+        self.assertEqual(len(idx.load([b"missing.txt"])), 0)
+
+    def test_stale_index(self):
+        idx = patch.utils.patch.PatchSet.open_indexed(self.filename)
+        self.assertEqual(len(idx), 5)
+        # index is rebuilt when patch changes
+        shutil.copy(testfile("git-changed-file.diff"), self.filename)
+        idx = patch.utils.patch.PatchSet.open_indexed(self.filename)
+        self.assertEqual(len(idx), 2)
+        self.assertEqual(idx.load().diffstat(),
+                         patch.fromfile(self.filename).diffstat())
+
+
+    def test_extra_hunk_line_starts_next_file(self):
+        with open(self.filename, "wb") as fp:
+          fp.write(b"--- a\n+++ a\n@@ -1 +1,2 @@\n x\n"
+                   b"--- b\n+++ b\n@@ -1 +1 @@\n-x\n+y\n")
+        pst = patch.utils.patch.PatchSet()
+        self.assertFalse(pst.parse_file(self.filename))
+        self.assertEqual([list(h.text) for h in pst.items[0]], [[b" x\n"]])
+        idx = patch.utils.patch.PatchSet.open_indexed(self.filename)
+        self.assertEqual([(e["header"], e["filenames"], e["end"]) for e in idx.files],
+                         [(0, 0, 29), (29, 29, 59)])
+        ps = idx.load([b"b"])
+        self.assertEqual(len(ps), 1)
+        self.assertEqual([h.text for h in ps.items[0]], [[b"-x\n", b"+y\n"]])
+        lazy = patch.utils.patch.PatchSet(lazy=True)
+        with open(self.filename, "rb") as fp:
+          lazy.parse(fp)
+          self.assertEqual([list(h.text) for h in lazy.items[0]], [[b" x\n"]])
+
+
 class TestPatchSetDetection(unittest.TestCase):
     def test_svn_detected(self):
         pto = patch.fromfile(join(TESTS, "01uni_multi/01uni_multi.patch"))